@@ -0,0 +1,116 @@
+"""Regression checks for the streaming JSON reader in testbed.py and the line
+diff in test_tools.py. Run from this folder like example_test.py."""
+
+import io
+import json
+import random
+
+from test_tools import UnitTestPack, diff_lines, _myers_diff
+from testbed import JSONStream, _iter_tests_array
+
+# Yes pylint, I know it's protected and undocumented. We're just testing it!
+# pylint: disable = protected-access
+# pylint: disable = missing-function-docstring
+
+# Numbers and strings that can be cut off anywhere by a chunk boundary
+TEST_FILE = """\
+{
+    "program": "example_program.py",
+    "tests": [
+        -1.5e3, 0, 12345678901234567890, 2.5E-7, -0.0, 10,
+        "plain", "esc\\"aped\\\\ \\u00e9\\n", "",
+        true, false, null,
+        {"function": "main", "args": [1, -2.25, [3, {"a": []}]], "kwdargs": {}},
+        [], {}, [[[-7]]]
+    ],
+    "after": {"n": 1e10}
+}
+"""
+
+DIFF_SEED = 2024
+DIFF_RUNS = 300
+
+
+def stream_all_chunk_sizes(text):
+    """Returns the chunk sizes whose stream of the tests array differs from
+    json.loads"""
+    expected = json.loads(text)["tests"]
+    bad_sizes = []
+    for chunk_size in range(1, len(text) + 2):
+        stream = JSONStream(io.StringIO(text), chunk_size)
+        if list(_iter_tests_array(stream)) != expected:
+            bad_sizes.append(chunk_size)
+    return bad_sizes
+
+
+def lcs_length(seq1, seq2):
+    """Length of the longest common subsequence, the slow and obvious way"""
+    row = [0] * (len(seq2) + 1)
+    for item in seq1:
+        prev_diag = 0
+        for j, other in enumerate(seq2):
+            prev_diag, row[j + 1] = row[j + 1], (
+                prev_diag + 1 if item == other else max(row[j], row[j + 1]))
+    return row[-1]
+
+
+def equal_total(opcodes, seq1, seq2):
+    """Number of matched items in opcodes, or None if they don't walk both
+    sequences in order or an equal hunk doesn't match"""
+    pos1 = pos2 = total = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if (i1, j1) != (pos1, pos2):
+            return None
+        if tag == "equal":
+            if seq1[i1:i2] != seq2[j1:j2]:
+                return None
+            total += i2 - i1
+        pos1, pos2 = i2, j2
+    if (pos1, pos2) != (len(seq1), len(seq2)):
+        return None
+    return total
+
+
+def diff_against_lcs(seed, runs):
+    """Returns the random cases whose diff doesn't keep as many lines as
+    their longest common subsequence"""
+    rand = random.Random(seed)
+    bad_cases = []
+    for _ in range(runs):
+        alphabet = "abcd"[:rand.randint(1, 4)]
+        lines1 = [rand.choice(alphabet) for _ in range(rand.randint(0, 30))]
+        lines2 = [rand.choice(alphabet) for _ in range(rand.randint(0, 30))]
+        expected = lcs_length(lines1, lines2)
+        myers = _myers_diff(lines1, lines2, len(lines1) + len(lines2))
+        if (equal_total(diff_lines(lines1, lines2), lines1, lines2) != expected
+                or equal_total(myers, lines1, lines2) != expected):
+            bad_cases.append((lines1, lines2))
+    return bad_cases
+
+
+tests = [
+    UnitTestPack(stream_all_chunk_sizes, TEST_FILE).config(
+        name = "JSONStream At Every Chunk Size",
+        expect_rval = []
+    ),
+
+    UnitTestPack(diff_against_lcs, DIFF_SEED, DIFF_RUNS).config(
+        name = "Diff Keeps The Longest Common Subsequence",
+        expect_rval = []
+    )
+]
+
+if __name__ == "__main__":
+    passed_tests = 0
+    for i,test in enumerate(tests):
+        try:
+            test()
+        # Catch all Exceptions, this is a test system wrapper afterall.
+        # pylint: disable = broad-exception-caught
+        except Exception as err:
+            pass
+
+        if test.success:
+            passed_tests += 1
+
+    print(f"{passed_tests} / {len(tests)} test(s) passed.")
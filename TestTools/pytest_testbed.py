@@ -0,0 +1,125 @@
+"""Pytest plugin that collects testbed JSON files as tests.
+
+Enable it with "-p pytest_testbed". Every test in a *_testbed.json file
+becomes its own pytest item, run by a UnitTestPack, so JSON suites can use
+pytest-xdist, --durations and pytest's other reports. The program under test
+is named by a "program" key next to "tests", relative to the JSON file.
+Without one, name_testbed.json tests name.py from the same folder.
+"""
+from collections import deque
+import contextlib
+import io
+import json
+import os
+import traceback
+import pytest
+import testbed
+
+TESTBED_SUFFIX = "_testbed.json"
+
+
+def pytest_collect_file(file_path, parent):
+    """Collects files ending in _testbed.json"""
+    if file_path.name.endswith(TESTBED_SUFFIX):
+        return TestbedFile.from_parent(parent, path=file_path)
+    return None
+
+
+def find_program(test_file, test_json: dict):
+    """Path of the program that a testbed file tests"""
+    if isinstance(test_json.get("program"), str):
+        return test_file.parent / test_json["program"]
+    return test_file.parent / (test_file.name[:-len(TESTBED_SUFFIX)] + ".py")
+
+
+class TestbedFile(pytest.File):
+    """A testbed JSON file. The program is imported the first time one of its
+    tests runs, once per process, so xdist workers only import the programs
+    of the tests they are given."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.program_path = None
+        self._program = None
+
+    def collect(self):
+        with open(self.path, "r", encoding="utf-8") as file:
+            test_json = json.load(file)
+        if not isinstance(test_json, dict) or not isinstance(test_json.get("tests"), list):
+            raise self.CollectError('A testbed file must have a "tests" array.')
+        self.program_path = find_program(self.path, test_json)
+        # Checked here so table tests can be expanded into their rows
+        errors = deque()
+        def validated():
+            for num, test_data in enumerate(test_json["tests"]):
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    valid = testbed.validate_test(num, test_data)
+                if not valid:
+                    errors.append(output.getvalue().strip())
+                yield num, test_data if valid else None
+
+        # Items are named by position so every xdist worker collects the
+        # same ids in the same order
+        for num, test_data in testbed.expand_tests(validated()):
+            yield TestbedItem.from_parent(
+                self, name=f"{num + 1}: {testbed.test_name(test_data)}",
+                num=num, test_data=test_data,
+                error=None if test_data is not None else errors.popleft()
+            )
+
+    def program(self):
+        """Returns the imported program"""
+        if self._program is None:
+            if not self.program_path.is_file():
+                raise FileNotFoundError(f"Program {self.program_path} does not exist")
+            self._program = testbed.read_program(str(self.program_path))
+        return self._program
+
+
+class TestbedFailure(Exception):
+    """A testbed test that didn't get the expected results"""
+
+
+class TestbedItem(pytest.Item):
+    """A single test from a testbed file"""
+    def __init__(self, *, num: int, test_data, error: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.num = num
+        self.test_data = test_data
+        self.error = error
+        self.test = None
+
+    def runtest(self):
+        if self.test_data is None:
+            raise TestbedFailure(self.error)
+        workdir = os.getcwd()
+        os.chdir(self.parent.program_path.parent)
+        try:
+            self.test = testbed.build_test(self.parent.program(), self.test_data)
+            try:
+                self.test()
+            except Exception:  # pylint: disable = broad-exception-caught
+                # The exception is kept on the test and reported below
+                pass
+        finally:
+            os.chdir(workdir)
+
+        metrics = self.test.metrics
+        self.user_properties.append(("wall_time", metrics.wall_time))
+        if metrics.cpu_time is not None:
+            self.user_properties.append(("cpu_time", metrics.cpu_time))
+        if not self.test.success:
+            raise TestbedFailure(self.test.name)
+
+    def repr_failure(self, excinfo, style=None):
+        if not isinstance(excinfo.value, TestbedFailure):
+            return super().repr_failure(excinfo, style)
+        if self.test is None:
+            return str(excinfo.value)
+        exception = self.test.exception
+        if exception is not None:
+            return "".join(traceback.format_exception(exception))
+        return (self.test.diff_str or "Failed").lstrip("\n")
+
+    def reportinfo(self):
+        return self.path, None, f"testbed test {self.name}"
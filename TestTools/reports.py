@@ -0,0 +1,131 @@
+"""Machine readable test reports, written as each result comes in"""
+import json
+import os
+import re
+from xml.sax.saxutils import escape, quoteattr
+
+# Longest rval or diff text kept in a report
+REPORT_TEXT_LIMIT = 4000
+
+ANSI_CODES = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# Characters that aren't allowed anywhere in an XML document
+XML_INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def plain_text(text, limit: int = REPORT_TEXT_LIMIT):
+    """Strips terminal colors from text and cuts it down to limit characters.
+    Returns None for None."""
+    if text is None:
+        return None
+    text = ANSI_CODES.sub("", text)
+    if len(text) > limit:
+        text = f"{text[:limit]}... [{len(text) - limit} more characters]"
+    return text
+
+
+def result_status(result) -> str:
+    """"passed" or "failed" for a TestResult"""
+    return "passed" if result.success else "failed"
+
+
+class JSONLinesReport:
+    """Writes one JSON object per test to a file, flushing after each one so
+    a crashed run still leaves every finished result behind"""
+    def __init__(self, filename, suite: str = ""):
+        self.suite = suite
+        self.file = open(filename, "w", encoding="utf-8")  # pylint: disable = consider-using-with
+
+    def add(self, result):
+        """Writes a TestResult to the report"""
+        metrics = result.metrics
+        record = {
+            "suite": self.suite,
+            "num": result.num + 1,
+            "name": result.name,
+            "status": result_status(result),
+            "cached": result.cached,
+            "wall_time": metrics.wall_time if metrics else None,
+            "cpu_time": metrics.cpu_time if metrics else None,
+            "peak_memory": metrics.peak_memory if metrics else None,
+            "stdout_bytes": metrics.stdout_bytes if metrics else None,
+            "stderr_bytes": metrics.stderr_bytes if metrics else None,
+            "rval": result.rval,
+            "diff": result.diff,
+            "error": result.error,
+            "profile": result.profile,
+        }
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        """Closes the report file"""
+        self.file.close()
+
+
+class JUnitReport:
+    """Writes a JUnit XML report one test case at a time. The totals on the
+    testsuite element are filled in by close, so a run that crashes leaves
+    a report with every finished test case but without its closing tags."""
+    # Room left in the testsuite start tag for the totals
+    TOTALS_WIDTH = 96
+
+    def __init__(self, filename, suite: str = ""):
+        self.suite = suite
+        self.tests = 0
+        self.failures = 0
+        self.time = 0.0
+        self.file = open(filename, "w", encoding="utf-8")  # pylint: disable = consider-using-with
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.file.write(f"<testsuite name={self._attr(suite)} ")
+        self.totals_at = self.file.tell()
+        self.file.write(f"{self._totals()}>\n")
+        self.file.flush()
+
+    @staticmethod
+    def _attr(text) -> str:
+        return quoteattr(XML_INVALID_CHARS.sub("", str(text)))
+
+    @staticmethod
+    def _text(text) -> str:
+        return escape(XML_INVALID_CHARS.sub("", str(text)))
+
+    def _totals(self) -> str:
+        totals = (f'tests="{self.tests}" failures="{self.failures}" '
+                  f'time="{self.time:.6f}"')
+        return totals.ljust(self.TOTALS_WIDTH)
+
+    def add(self, result):
+        """Writes a TestResult to the report"""
+        wall_time = result.metrics.wall_time if result.metrics else 0.0
+        self.tests += 1
+        self.time += wall_time
+        lines = [f"  <testcase name={self._attr(result.name)} "
+                 f"classname={self._attr(self.suite)} time=\"{wall_time:.6f}\">"]
+        if not result.success:
+            self.failures += 1
+            message = result.error or ("Failed (cached)" if result.cached else "Failed")
+            lines.append(f"    <failure message={self._attr(message)}>"
+                         f"{self._text(result.diff or '')}</failure>")
+        if result.rval is not None:
+            lines.append(f"    <system-out>rval: {self._text(result.rval)}</system-out>")
+        lines.append("  </testcase>\n")
+        self.file.write("\n".join(lines))
+        self.file.flush()
+
+    def close(self):
+        """Writes the closing tags and the totals, then closes the file"""
+        self.file.write("</testsuite>\n")
+        self.file.seek(self.totals_at)
+        self.file.write(self._totals())
+        self.file.close()
+
+
+def open_report(filename, suite: str = ""):
+    """Opens a report writer picked by the file's extension: .xml for JUnit
+    XML, .jsonl for JSON Lines. Raises ValueError for anything else."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".xml":
+        return JUnitReport(filename, suite)
+    if extension == ".jsonl":
+        return JSONLinesReport(filename, suite)
+    raise ValueError(f"Unknown report format for {filename}, use .xml or .jsonl")
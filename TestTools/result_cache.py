@@ -0,0 +1,222 @@
+"""On-disk cache of test results so unchanged tests can be skipped"""
+from collections import OrderedDict
+import hashlib
+import inspect
+import json
+import os
+import sysconfig
+import tempfile
+import types
+
+
+def hash_file(filename):
+    """Returns the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_files(test_settings: dict) -> list:
+    """Files a test's user_input is read from, relative to the program"""
+    filenames = []
+    for section in (test_settings.get("config"), test_settings.get("row")):
+        if isinstance(section, dict) and isinstance(section.get("user_input_file"), str):
+            filenames.append(section["user_input_file"])
+    return filenames
+
+
+class ResultCache:
+    """Keeps the results of previous test runs in a JSON file, keyed by a
+    hash of the program source and the test's settings. The least recently
+    used entries are dropped once there are more than max_entries."""
+    def __init__(self, filename, max_entries: int = 10000, source_hash: str = ""):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.source_hash = source_hash
+        self.entries = OrderedDict()
+        self.changed = False
+
+    def load(self):
+        """Reads the cache file. A missing or damaged file starts empty."""
+        try:
+            with open(self.filename, "r", encoding="utf-8") as file:
+                self.entries = OrderedDict(json.load(file))
+        except (OSError, ValueError, TypeError):
+            self.entries = OrderedDict()
+        return self
+
+    def save(self):
+        """Writes the cache file if anything changed. The file is replaced
+        in one step so an interrupted run can't leave it half written."""
+        if not self.changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                json.dump(self.entries, file)
+            os.replace(temp_name, self.filename)
+        except OSError:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+        self.changed = False
+
+    @staticmethod
+    def key(source_hash: str, test_settings: dict) -> str:
+        """Cache key for a test of a program whose source hashes to
+        source_hash"""
+        settings = json.dumps(test_settings, sort_keys=True, default=repr)
+        digest = hashlib.sha256(f"{source_hash}\n{settings}".encode())
+        # A test reading its input from a file changes along with the file
+        for filename in input_files(test_settings):
+            digest.update((hash_file(filename) if os.path.isfile(filename)
+                           else "missing").encode())
+        return digest.hexdigest()
+
+    def lookup(self, test_settings: dict):
+        """Returns (key, entry) for a test, where entry is None unless the
+        test's last result can be reused"""
+        key = self.key(self.source_hash, test_settings)
+        return key, self.get(key)
+
+    def store(self, key: str, name: str, success: bool, touched_code=None):
+        """Caches a test's result under the key from lookup"""
+        # pylint: disable = unused-argument
+        self.put(key, {"name": name, "success": success})
+
+    def get(self, key: str):
+        """Returns the cached entry for key, or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: dict):
+        """Stores an entry, dropping the least recently used ones if full"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.changed = True
+
+
+def _code_hash(code: types.CodeType) -> str:
+    """Hash of what a code object does, ignoring line numbers so moving a
+    function around in its file doesn't count as a change. Functions include
+    the code nested in them, while module and class bodies only cover their
+    own statements."""
+    digest = hashlib.sha256(code.co_code)
+    digest.update(repr((code.co_names, code.co_varnames, code.co_freevars,
+                        code.co_cellvars, code.co_argcount,
+                        code.co_kwonlyargcount, code.co_flags)).encode())
+    is_function = code.co_flags & inspect.CO_NEWLOCALS
+    for const in code.co_consts:
+        if not isinstance(const, types.CodeType):
+            digest.update(repr(const).encode())
+        elif is_function:
+            digest.update(_code_hash(const).encode())
+        else:
+            digest.update(getattr(const, "co_qualname", const.co_name).encode())
+    return digest.hexdigest()
+
+
+def is_scope(name: str) -> bool:
+    """Whether a name from code_fingerprints is a module or class body"""
+    return name == "<module>" or name.endswith(".<body>")
+
+
+def code_fingerprints(filename) -> dict:
+    """Compiles a source file and returns the hash of every function in it,
+    keyed by qualified name. Class bodies are keyed as "<class>.<body>" and
+    the module itself as "<module>". Returns an empty dict if the file can't
+    be read."""
+    try:
+        with open(filename, "rb") as file:
+            module_code = compile(file.read(), filename, "exec", dont_inherit=True)
+    except (OSError, SyntaxError, ValueError):
+        return {}
+    fingerprints = {}
+    codes = [module_code]
+    while codes:
+        code = codes.pop()
+        name = getattr(code, "co_qualname", code.co_name)
+        if code is not module_code and not code.co_flags & inspect.CO_NEWLOCALS:
+            name += ".<body>"
+        # Keep every function with the same name, such as lambdas
+        fingerprints[name] = fingerprints.get(name, "") + _code_hash(code)
+        codes.extend(c for c in code.co_consts if isinstance(c, types.CodeType))
+    return {name: hashlib.sha256(hashes.encode()).hexdigest()
+            for name, hashes in fingerprints.items()}
+
+
+class DependencyCache(ResultCache):
+    """Result cache that remembers which functions each test called and what
+    they looked like. A test only has to run again once one of those
+    functions changes, wherever it is defined, or the module or class level
+    code of a file it called into changes. Functions in the standard library
+    are not tracked."""
+    IGNORED_PATHS = tuple(
+        os.path.normcase(os.path.abspath(path))
+        for path in {sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["platstdlib"]}
+    )
+
+    def __init__(self, filename, max_entries: int = 10000, program: str = ""):
+        super().__init__(filename, max_entries, program)
+        self.fingerprints = {}
+
+    def file_fingerprints(self, filename) -> dict:
+        """Current function hashes of a source file, compiled once per run"""
+        if filename not in self.fingerprints:
+            self.fingerprints[filename] = code_fingerprints(filename)
+        return self.fingerprints[filename]
+
+    def is_tracked(self, filename) -> bool:
+        """Whether calls into a file are worth tracking"""
+        if not os.path.isfile(filename):
+            return False
+        path = os.path.normcase(os.path.abspath(filename))
+        return not path.startswith(self.IGNORED_PATHS)
+
+    def lookup(self, test_settings: dict):
+        """Returns (key, entry) for a test, where entry is None unless none of
+        the functions the test called last time have changed since"""
+        key = self.key(self.source_hash, test_settings)
+        return key, self.get_unchanged(key)
+
+    def get_unchanged(self, key: str):
+        """Returns the entry for key if none of the functions the test called
+        last time have changed since, otherwise None"""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        for filename, functions in entry["code"].items():
+            fingerprints = self.file_fingerprints(filename)
+            for name, fingerprint in functions.items():
+                if fingerprints.get(name) != fingerprint:
+                    return None
+        return entry
+
+    def store(self, key: str, name: str, success: bool, touched_code=None):
+        """Stores a test's result along with the current hash of each
+        function it called. The module and class level code of the program
+        is always included, so a test that called nothing that is tracked,
+        such as one for a function that didn't exist yet, still runs again
+        once the program changes."""
+        code = {}
+        # The program's path, for a DependencyCache
+        touched = [(self.source_hash, "<module>")]
+        touched.extend(touched_code or ())
+        for filename, function in touched:
+            if not self.is_tracked(filename):
+                continue
+            fingerprints = self.file_fingerprints(filename)
+            if filename not in code:
+                # Globals and class attributes can change what a function does
+                code[filename] = {name: fingerprint for name, fingerprint
+                                  in fingerprints.items() if is_scope(name)}
+            if function in fingerprints:
+                code[filename][function] = fingerprints[function]
+        self.put(key, {"name": name, "success": success, "code": code})
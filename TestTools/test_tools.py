@@ -1,514 +1,1958 @@
-"""Tools for testing user I/O and timeout tests"""
-# Limitations:
-#  - Captured output must not exceed a reasonable length for a string!
-
-
-from typing import Callable, Any, Iterable
-from collections import namedtuple
-import builtins
-import threading
-import queue
-import ctypes
-import sys
-import traceback
-
-class Tcolors:
-    """Definitions for colors within terminal text"""
-
-    default = "\33[0m"
-    bold = "\33[1m"
-    underline = "\33[4m"
-    nunderline = "\33[24m"
-    reverse = "\33[7m"
-    forward = "\33[27m"
-
-    class fg:  # pylint: disable = invalid-name
-        """Foreground colors"""
-
-        black = "\33[30m"
-        dred = "\33[31m"
-        dgreen = "\33[32m"
-        dyellow = "\33[33m"
-        dblue = "\33[34m"
-        dmagenta = "\33[35m"
-        dcyan = "\33[36m"
-        dgray = "\33[90m"
-        gray = "\33[37m"
-        red = "\33[91m"
-        green = "\33[92m"
-        yellow = "\33[93m"
-        blue = "\33[94m"
-        magenta = "\33[95m"
-        cyan = "\33[96m"
-        white = "\33[97m"
-
-    class bg:  # pylint: disable = invalid-name
-        """Background colors (Work in progress)"""
-
-        black = "\33[40m"
-        dred = "\33[41m"
-        dgreen = "\33[42m"
-        dyellow = "\33[43m"
-        dblue = "\33[44m"
-        dmagenta = "\33[45m"
-        dcyan = "\33[46m"
-        dgray = "\33[100m"
-        gray = "\33[47m"
-        red = "\33[101m"
-        green = "\33[102m"
-        yellow = "\33[103m"
-        blue = "\33[104m"
-        magenta = "\33[105m"
-        cyan = "\33[106m"
-        white = "\33[107m"
-
-
-class UnitTestError(Exception):
-    """Raised by unit tests when the unit test encounters an error."""
-
-
-class TestTimeoutError(UnitTestError):
-    """Raised by unit tests when the unit test times out."""
-
-
-class UnexpectedInputError(UnitTestError):
-    """Raised by unit tests when the program asks for input that is not
-    provided.
-    """
-
-class UnknownValue:
-    """Dummy class to specify an untested value"""
-
-
-class ExceptionThread(threading.Thread):
-    """Special form of thread that terminates by raising an exception"""
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args,**kwargs)
-
-    def get_id(self):
-        """Returns id of the respective thread"""
-        if hasattr(self, '_thread_id'):
-            return self._thread_id
-        #pylint: disable=protected-access
-        for id_, thread in threading._active.items():
-            if thread is self:
-                return id_
-    def terminate(self):
-        """Terminates the thread by raising SystemExit in the thread"""
-        thread_id = self.get_id()
-        res = ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id,
-              ctypes.py_object(SystemExit))
-        if res > 1:
-            ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, 0)
-            print('Exception raise failure')
-
-class UnitTestPack:
-    """Packs a Callable object with it's arguments so it can all be
-    transported together."""
-    #pylint: disable = attribute-defined-outside-init
-    def __init__(self, func: Callable, *args, **kwds):
-        # Pack function
-        self.func = func
-        self.args = args
-        self.kwds = kwds
-        self.run = self.__call__
-
-        # Initialize Results
-        self.reset_results()
-
-        # Set Defaults
-        self.name = "Untitled"
-        self.timeout = 10
-        self._user_input = tuple()
-        self.capture_input = True
-        self.print_input = True
-        self.print_out = True
-        self.print_err = True
-        self.expect_out = None
-        self.expect_err = None
-        self.expect_rval = UnknownValue()
-        self.expect_success = True
-
-    def reset_results(self):
-        """Resets results and is called before each run."""
-        self._stdout = ""
-        self._stderr = ""
-        self._rval = UnknownValue()
-        self._success = False
-        self._diff_str = None
-        self._exception = None
-
-    # Read only properties
-    @property
-    def stdout(self):
-        """stdout is a read only property"""
-        return self._stdout
-
-    @property
-    def stderr(self):
-        """stderr is a read only property"""
-        return self._stderr
-
-    @property
-    def rval(self):
-        """rval is a read only property"""
-        return self._rval
-
-    @property
-    def success(self):
-        """Success is a read only property"""
-        return self._success
-
-    @property
-    def diff_str(self):
-        """diff_str is a read only property"""
-        return self._diff_str
-
-    @property
-    def exception(self):
-        """Exception is a read only property"""
-        return self._exception
-
-    def config(self,
-               name: str = None,
-               timeout: int = None,
-               user_input: Iterable = None,
-               print_input: bool = None,
-               capture_input: bool = None,
-               print_out: bool = None,
-               print_err: bool = None,
-               expect_out: str|list[str] = None,
-               expect_err: str|list[str] = None,
-               expect_rval: Any = UnknownValue(),
-               expect_success: bool = None
-               ):
-        """Configures the attributes of the class and returns self.
-        Use for inline test configurations.\n
-        Please use "set_args" to change function arguments after creation.
-        """
-        if name is not None:
-            self.name = name
-        if not isinstance(expect_rval, UnknownValue):
-            self.expect_rval = expect_rval
-        if timeout is not None:
-            self.timeout = timeout
-        if user_input is not None:
-            self.user_input = user_input
-        if print_input is not None:
-            self.print_input = print_input
-        if capture_input is not None:
-            self.capture_input = capture_input
-        if expect_out is not None:
-            if isinstance(expect_out, str):
-                self.expect_out = expect_out
-            elif isinstance(expect_out, Iterable):
-                self.expect_out = '\n'.join(str(x) for x in expect_out) + '\n'
-            else:
-                self.expect_out = str(expect_out)
-        if expect_err is not None:
-            if isinstance(expect_err, str):
-                self.expect_err = expect_err
-            elif isinstance(expect_err, Iterable):
-                self.expect_err = ''.join(str(x) + '\n' for x in expect_err)
-            else:
-                self.expect_err = str(expect_err)
-        if print_out is not None:
-            self.print_out = print_out
-        if print_err is not None:
-            self.print_err = print_err
-        if expect_success is not None:
-            self.expect_success = expect_success
-        return self
-
-    @property
-    def user_input(self):
-        """Get user_input tuple that replaces calls to
-        input() when the function is run."""
-        return self._user_input
-
-    @user_input.setter
-    def user_input(self, values: Iterable):
-        """Set user input to replace calls to input() with
-        when the function is run."""
-        if isinstance(values,str):
-            self._user_input = (values,)
-        elif isinstance(values,Iterable):
-            self._user_input = tuple(str(x) for x in values)
-        else:
-            self._user_input = (str(values),)
-
-    def get_diff(self):
-        """Get difference in output of the test function from the expected 
-        output provided to the class.
-        """
-        success = True
-        diff_str = ""
-        if not isinstance(self.expect_rval, UnknownValue):
-            if self.rval != self.expect_rval:
-                success = False
-                diff_str += "".join((
-                    f"\n{Tcolors.fg.yellow}====> Return Value Diff <====\n",
-                    f"Received: {Tcolors.default}",
-                    repr(self.rval),
-                    f"\n{Tcolors.fg.yellow}Expected: {Tcolors.default}",
-                    repr(self.expect_rval)
-                ))
-        if self.expect_out is not None:
-            if self.stdout != self.expect_out:
-                success = False
-                diff_str += "".join((
-                    f"\n{Tcolors.fg.yellow}====> Standard Output Diff <====\n",
-                    f"Expected:{Tcolors.default}\n",
-                    compare_diff(self.stdout,self.expect_out)
-                ))
-        if self.expect_err is not None:
-            if self.stderr != self.expect_err:
-                success = False
-                diff_str += "".join((
-                    f"\n{Tcolors.fg.yellow}====> Error Output Diff <====\n",
-                    f"Expected:{Tcolors.default}\n",
-                    compare_diff(self.stderr,self.expect_err)
-                ))
-        DiffResult = namedtuple("DiffResult", ('success', 'diff_str'))
-        return DiffResult(success,diff_str)
-
-    def set_args(self, *args, **kwds):
-        """Set or change the arguments passed into the function by default.
-        Returns self for further inline configuration.
-        """
-        self.args = args
-        self.kwds = kwds
-        return self
-
-    def __call__(self) -> Any:
-        #pylint: disable = broad-exception-caught
-        print(f"{Tcolors.fg.blue}\tRunning test: {self.name} ...{Tcolors.default}")
-        self.reset_results()
-        try:
-            # if the timeout is not set or one of the specified debuggers is
-            # debugging this code, run in main thread
-            if (
-                self.timeout is None
-                or self.timeout <= 0
-
-                ## This was here to allow debugger to run without timing out
-                ## but VSCode's Pytest tool updated so it's always in debug mode.
-
-                # or "pydevd" in sys.modules
-                # or "pdb" in sys.modules
-            ):
-                self._run_in_main()
-            else:
-                # Otherwise, run in a timed thread
-                self._run_as_task()
-        except Exception as exc:
-            print(f"{Tcolors.fg.red}{exc.__class__.__name__}: {exc}{Tcolors.default}")
-            print()
-            self._exception = exc
-
-        if self.exception is None:
-            self._success, self._diff_str = self.get_diff()
-
-        if self.success == self.expect_success:
-            self._success = True
-            print(f"{Tcolors.fg.green}Success{Tcolors.default}")
-        else:
-            print(f"{Tcolors.fg.red}Failed{Tcolors.default}")
-            if self.exception is not None:
-                raise self.exception
-            print(self.diff_str)
-        return self.rval
-
-    def _run_in_main(self):
-        real_stdout_write = sys.stdout.write
-        real_stderr_write = sys.stderr.write
-        real_input = builtins.input
-
-        # For some reason this only works if the counter is
-        # a mutable object and not an integer
-        class Counter:
-            """Mutable counter object"""
-            def __init__(self):
-                self.count = 0
-
-        counter = Counter()
-        def fake_input(_prompt: str = ""):
-            if counter.count >= len(self._user_input):
-                raise UnexpectedInputError("Program is asking for too many inputs!")
-            rval = self._user_input[counter.count]
-            counter.count+= 1
-            if self.print_input:
-                if self.capture_input:
-                    self._stdout += f"{_prompt}{rval}\n"
-                else:
-                    real_stdout_write(Tcolors.fg.dcyan)
-                real_stdout_write(
-                    f"{_prompt}"
-                    f"{Tcolors.underline}{rval}"
-                    f"{Tcolors.default}\n")
-            return rval
-
-        def fake_stdout_write(_s):
-            """
-            Copies output to the stdout string and then passes
-            the output to the original write function
-            """
-            self._stdout += _s
-            if self.print_out:
-                real_stdout_write(_s)
-
-        def fake_stderr_write(_s):
-            """
-            Copies error output to the stderr string and then passes
-            the output to the original write function
-            """
-            self._stderr += _s
-            if self.print_err:
-                real_stderr_write(Tcolors.fg.dmagenta + _s + Tcolors.default)
-
-
-        # Patch user input and output for interception
-        builtins.input = fake_input
-        sys.stdout.write = fake_stdout_write
-        sys.stderr.write = fake_stderr_write
-
-        try:
-            # Breakpoint here to hold the debugger in a timed function
-            self._rval = self.func(*self.args, **self.kwds)
-        finally:
-            # Put everything back, even if there's an error
-            builtins.input = real_input
-            sys.stdout.write = real_stdout_write
-            sys.stderr.write = real_stderr_write
-
-        return self.rval
-
-    def _start_task(self, return_queue: queue.Queue):
-        # pylint: disable = broad-exception-caught
-        exception_state = None
-        try:
-            self._run_in_main()
-        except BaseException as exc:
-            # Remove the traces for background functions
-            tb_stack = traceback.extract_tb(exc.__traceback__)[2:]
-            exception_state = (
-                exc,
-                f"{exc}\n\nOriginal Traceback (most recent call last):\n"
-                f"{''.join(traceback.format_list(tb_stack))}"
-                f"{exc.__class__.__name__}: {exc}",
-            )
-        return_queue.put(exception_state)
-        return_queue.put(self.rval)
-        return_queue.put(self.stdout)
-        return_queue.put(self.stderr)
-
-    def _run_as_task(self):
-
-
-        # pylint: disable = invalid-name
-        ret_queue = queue.Queue()
-        p = ExceptionThread(target=self._start_task, args=(ret_queue,))
-
-        p.start()
-
-        # Wait for for timeout or until process finishes
-        p.join(float(self.timeout))
-
-        terminated = False
-
-        # If thread is still active
-        if p.is_alive():
-            # Terminate - may not work if process is stuck for good.
-            # IDK how to force if terminate doesn't work
-
-            p.terminate()
-            terminated = True
-            # Give it some more time
-            p.join()
-
-        if terminated:
-            raise TestTimeoutError("Test timed out.")
-
-        if not ret_queue.empty():
-            exception = ret_queue.get()
-            self._rval = ret_queue.get()
-            self._stdout = ret_queue.get()
-            self._stderr = ret_queue.get()
-            if exception is not None:
-                raise type(exception[0])(exception[1])
-            return self.rval
-        else:
-            return None
-
-def compare_diff(str1: str, str2: str):
-    """Compare two strings and show difference on each line if not equal"""
-    unprintable_chars = {
-        "\t":"→",
-        "\n":"↵",
-        "\r":"↩",
-        "\b":"← ",
-        "\v":"↓",
-        "\a":"🕭",
-        "\x00":"␀ ",
-        "\x1B":"␛ ",
-    }
-    # pylint: disable = invalid-name
-    error_on_line = False
-    out_str = ""
-    no_diff = True
-    i1 = 0
-    i2 = 0
-    len1 = len(str1)
-    len2 = len(str2)
-    ERROR_COLOR = Tcolors.fg.red + Tcolors.underline
-    while i1 < len1 and i2 < len2:
-        if str1[i1] != str2[i2] and not error_on_line:
-            error_on_line = True
-            out_str += ERROR_COLOR
-            no_diff = False
-        if error_on_line and (not str2[i2].isprintable()):
-            if not str2[i2] in unprintable_chars:
-                out_str += "•"
-            else:
-                out_str += unprintable_chars[str2[i2]]
-
-        out_str += str2[i2]
-
-        # Re-sync the lines
-        if str1[i1] == '\n':
-            while i2 < len2 and str2[i2] != '\n':
-                i2 += 1
-                if not str2[i2].isprintable():
-                    if not str2[i2] in unprintable_chars:
-                        out_str += "•"
-                    else:
-                        out_str += unprintable_chars[str2[i2]]
-                out_str += str2[i2]
-            error_on_line = False
-            out_str += Tcolors.default
-
-        elif str2[i2] == '\n':
-            while i1 < len1 and str1[i1] != '\n':
-                i1 += 1
-            error_on_line = False
-            out_str += Tcolors.default
-
-        # Increment the indecies
-        if i1 < len1:
-            i1 += 1
-        if i2 < len2:
-            i2 += 1
-
-    if i2 < len2:
-        out_str += (
-            f"{ERROR_COLOR}...[{len(str2) - i2} more chars]"
-        )
-        no_diff = False
-
-    if not out_str.endswith(Tcolors.default):
-        out_str += Tcolors.default
-    rval = ""
-    if not no_diff:
-        rval = out_str
-
-    return rval
+"""Tools for testing user I/O and timeout tests"""
+# Limitations:
+#  - Captured output is joined into a single string when it is read. Use
+#    capture_limit and capture_spill to bound memory for very chatty programs.
+
+
+from typing import Callable, Any, Iterable
+import asyncio
+import builtins
+from collections import namedtuple
+import contextlib
+import contextvars
+import cProfile
+import itertools
+import multiprocessing
+import tempfile
+import threading
+import queue
+import ctypes
+import inspect
+import math
+import mmap
+import os
+import re
+import signal
+import statistics
+import sys
+import time
+import traceback
+import tracemalloc
+
+# Seconds to wait for a terminated test to stop before giving up on it
+TERMINATE_GRACE = 1.0
+
+class Tcolors:
+    """Definitions for colors within terminal text"""
+
+    default = "\33[0m"
+    bold = "\33[1m"
+    underline = "\33[4m"
+    nunderline = "\33[24m"
+    reverse = "\33[7m"
+    forward = "\33[27m"
+
+    class fg:  # pylint: disable = invalid-name
+        """Foreground colors"""
+
+        black = "\33[30m"
+        dred = "\33[31m"
+        dgreen = "\33[32m"
+        dyellow = "\33[33m"
+        dblue = "\33[34m"
+        dmagenta = "\33[35m"
+        dcyan = "\33[36m"
+        dgray = "\33[90m"
+        gray = "\33[37m"
+        red = "\33[91m"
+        green = "\33[92m"
+        yellow = "\33[93m"
+        blue = "\33[94m"
+        magenta = "\33[95m"
+        cyan = "\33[96m"
+        white = "\33[97m"
+
+    class bg:  # pylint: disable = invalid-name
+        """Background colors (Work in progress)"""
+
+        black = "\33[40m"
+        dred = "\33[41m"
+        dgreen = "\33[42m"
+        dyellow = "\33[43m"
+        dblue = "\33[44m"
+        dmagenta = "\33[45m"
+        dcyan = "\33[46m"
+        dgray = "\33[100m"
+        gray = "\33[47m"
+        red = "\33[101m"
+        green = "\33[102m"
+        yellow = "\33[103m"
+        blue = "\33[104m"
+        magenta = "\33[105m"
+        cyan = "\33[106m"
+        white = "\33[107m"
+
+
+# Escape codes of every color, kept so they can be switched back on
+_COLOR_CODES = {
+    cls: {name: code for name, code in vars(cls).items()
+          if isinstance(code, str) and code.startswith("\33")}
+    for cls in (Tcolors, Tcolors.fg, Tcolors.bg)
+}
+
+
+def set_colors(enabled: bool):
+    """Turns the escape codes in Tcolors on or off. With colors off every
+    code is an empty string."""
+    for cls, codes in _COLOR_CODES.items():
+        for name, code in codes.items():
+            setattr(cls, name, code if enabled else "")
+
+
+def wants_colors(stream=None) -> bool:
+    """Whether text written to stream (sys.stdout by default) should be
+    colored, which is only when it's a terminal. The NO_COLOR and
+    FORCE_COLOR environment variables override that."""
+    if os.environ.get("NO_COLOR"):
+        return False
+    if os.environ.get("FORCE_COLOR"):
+        return True
+    stream = sys.stdout if stream is None else stream
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+set_colors(wants_colors())
+
+
+class UnitTestError(Exception):
+    """Raised by unit tests when the unit test encounters an error."""
+
+
+class TestTimeoutError(UnitTestError):
+    """Raised by unit tests when the unit test times out."""
+
+
+class UnexpectedInputError(UnitTestError):
+    """Raised by unit tests when the program asks for input that is not
+    provided.
+    """
+
+
+class OutputMismatchError(UnitTestError):
+    """Raised inside a fail_fast test as soon as its output stops matching
+    expect_out. The test fails with the usual output diff."""
+
+class UnknownValue:
+    """Dummy class to specify an untested value"""
+
+
+BenchmarkResult = namedtuple("BenchmarkResult", (
+    "name",
+    "success",   # Whether the checked first run passed
+    "runs",      # Number of timed runs
+    "min",       # Timings of the timed runs, in seconds
+    "median",
+    "p95",
+    "mean",
+    "stddev",
+))
+
+TestMetrics = namedtuple("TestMetrics", (
+    "wall_time",     # Seconds the function ran for
+    "cpu_time",      # CPU seconds used by the thread running the function
+    "peak_memory",   # Peak bytes allocated while it ran, if measure_memory
+    "stdout_bytes",  # Bytes written to stdout
+    "stderr_bytes",  # Bytes written to stderr
+))
+
+
+class DiffResult:
+    """Outcome of comparing a test's results with the expected ones.
+    Holds the raw values of each mismatch and only renders diff_str the
+    first time it is read. With render=False, diff_str only names the parts
+    of the results that did not match."""
+    __slots__ = ("success", "mismatches", "render", "_diff_str")
+
+    def __init__(self, success: bool, mismatches: list, render: bool = True):
+        self.success = success
+        self.mismatches = mismatches
+        self.render = render
+        self._diff_str = None
+
+    @property
+    def diff_str(self) -> str:
+        """Diff text for all the mismatches, built on first access"""
+        if self._diff_str is None:
+            self._diff_str = "".join(
+                self._render_mismatch(*mismatch) for mismatch in self.mismatches
+            )
+        return self._diff_str
+
+    def _render_mismatch(self, title: str, received: Any, expected: Any):
+        header = f"\n{Tcolors.fg.yellow}====> {title} Diff <===="
+        if not self.render:
+            return f"{header}{Tcolors.default}"
+        if title == "Performance":
+            return "".join((
+                f"{header}{Tcolors.default}",
+                *(f"\n{label}: {Tcolors.fg.red}{received[label]}{Tcolors.default}"
+                  f" (limit {expected[label]})" for label in received)
+            ))
+        if title == "Return Value":
+            return "".join((
+                f"{header}\nReceived: {Tcolors.default}",
+                repr(received),
+                f"\n{Tcolors.fg.yellow}Expected: {Tcolors.default}",
+                repr(expected)
+            ))
+        return "".join((
+            f"{header}\nExpected:{Tcolors.default}\n",
+            compare_diff(received, expected)
+        ))
+
+    def __iter__(self):
+        # Allows unpacking like the (success, diff_str) tuple it replaces
+        return iter((self.success, self.diff_str))
+
+
+class CaptureBuffer:
+    """Collects captured stream output in chunks and only joins them into a
+    single string when the text is read.\n
+    limit: Maximum number of characters kept. Anything past it is dropped and
+    the buffer is marked as truncated. None keeps everything.\n
+    spill: Number of characters after which the captured text is moved into
+    a temporary file instead of being kept in memory. None never spills.
+    """
+    __slots__ = ("limit", "spill", "size", "nbytes", "truncated", "_kept", "_chunks", "_file")
+
+    def __init__(self, limit: int = None, spill: int = None):
+        self.limit = limit
+        self.spill = spill
+        self.size = 0
+        self.nbytes = 0
+        self.truncated = False
+        self._kept = 0
+        self._chunks = []
+        self._file = None
+
+    _EMPTY = ""
+
+    def write(self, text: str):
+        """Appends text to the buffer"""
+        self.size += len(text)
+        self.nbytes += self._count_bytes(text)
+        if self.limit is not None and self._kept + len(text) > self.limit:
+            self.truncated = True
+            text = text[:max(self.limit - self._kept, 0)]
+            if not text:
+                return
+        self._kept += len(text)
+        if self._file is not None:
+            self._file.write(text)
+            return
+        self._chunks.append(text)
+        if self.spill is not None and self._kept > self.spill:
+            self._file = self._open_spill_file()
+            self._file.writelines(self._chunks)
+            self._chunks = []
+
+    @staticmethod
+    def _count_bytes(text: str) -> int:
+        return len(text) if text.isascii() else len(text.encode("utf-8", "surrogatepass"))
+
+    @staticmethod
+    def _open_spill_file():
+        # pylint: disable = consider-using-with
+        return tempfile.TemporaryFile(
+            "w+", encoding="utf-8", errors="surrogatepass", newline=""
+        )
+
+    def _read_all(self):
+        if self._file is not None:
+            self._file.seek(0)
+            value = self._file.read()
+            self._file.seek(0, 2)
+            return value
+        if len(self._chunks) > 1:
+            self._chunks = [self._EMPTY.join(self._chunks)]
+        return self._chunks[0] if self._chunks else self._EMPTY
+
+    def getvalue(self) -> str:
+        """Returns all of the captured text as a single string"""
+        return self._read_all()
+
+    def close(self):
+        """Releases the temporary file if the buffer has spilled"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._chunks = []
+
+    def __len__(self):
+        return self._kept
+
+    def __str__(self):
+        return self.getvalue()
+
+
+class ByteCaptureBuffer(CaptureBuffer):
+    """CaptureBuffer for raw bytes, used when capturing file descriptors.
+    limit and spill count bytes instead of characters. getvalue decodes the
+    bytes as UTF-8 and getbytes returns them as they were written."""
+    __slots__ = ()
+    _EMPTY = b""
+
+    @staticmethod
+    def _count_bytes(text: bytes) -> int:
+        return len(text)
+
+    @staticmethod
+    def _open_spill_file():
+        return tempfile.TemporaryFile("w+b")  # pylint: disable = consider-using-with
+
+    def getbytes(self) -> bytes:
+        """Returns all of the captured bytes"""
+        return self._read_all()
+
+    def getvalue(self) -> str:
+        """Returns all of the captured output decoded as text"""
+        value = self._read_all().decode("utf-8", "replace")
+        if os.linesep != "\n":
+            value = value.replace(os.linesep, "\n")
+        return value
+
+
+class InputFile:
+    """user_input read from a file one line at a time, for inputs too large
+    to build ahead of time. The file is memory mapped for each run instead of
+    being loaded, so the same InputFile can feed any number of runs. Lines are
+    given without their line endings."""
+    __slots__ = ("filename", "encoding")
+
+    def __init__(self, filename, encoding: str = "utf-8"):
+        self.filename = os.fspath(filename)
+        self.encoding = encoding
+
+    def __iter__(self):
+        with open(self.filename, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                # Empty files can't be mapped
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start, size = 0, len(data)
+                while start < size:
+                    end = data.find(b"\n", start)
+                    if end < 0:
+                        end = size
+                    line = data[start:end]
+                    if line.endswith(b"\r"):
+                        line = line[:-1]
+                    yield line.decode(self.encoding)
+                    start = end + 1
+
+    def __repr__(self):
+        return f"InputFile({self.filename!r})"
+
+
+_libc = None
+
+def _load_libc():
+    """Returns the process's C runtime, or False if there isn't one to call"""
+    global _libc  # pylint: disable = global-statement
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(None)
+        except (OSError, TypeError):
+            # No C runtime to load, such as on Windows
+            _libc = False
+    return _libc
+
+def _flush_std_streams():
+    """Flushes Python's and C's buffered standard output and error so it
+    reaches the file descriptors they currently point at"""
+    for stream in (sys.stdout, sys.stderr, sys.__stdout__, sys.__stderr__):
+        try:
+            stream.flush()
+        except (AttributeError, ValueError, OSError):
+            pass
+    libc = _load_libc()
+    if libc:
+        libc.fflush(None)
+
+# prctl option asking Linux to signal this process when its parent ends
+_PR_SET_PDEATHSIG = 1
+
+def _die_with_parent(parent_pid: int):
+    """Has Linux kill this process when the process that started it ends, so
+    an isolated test can't outlive a worker that was killed. Does nothing on
+    other systems."""
+    if not sys.platform.startswith("linux"):
+        return
+    libc = _load_libc()
+    if not libc:
+        return
+    libc.prctl(_PR_SET_PDEATHSIG, signal.SIGKILL, 0, 0, 0)
+    if os.getppid() != parent_pid:
+        # The parent ended before the signal was set up
+        os._exit(1)
+
+
+def _write_fd(fd: int, data: bytes):
+    """Writes all of data to a file descriptor"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _stream_fd(stream):
+    """File descriptor a stream writes to, or None"""
+    try:
+        return stream.fileno()
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+# File descriptors belong to the whole process, so tests capturing them run
+# one at a time. Held for a whole run so other tests' banners stay out.
+_fd_capture_lock = threading.RLock()
+
+class FdCapture:
+    """Points file descriptors 1 and 2 at pipes while a test runs, so that
+    everything written to them is captured, including output from C code,
+    os.write() and subprocesses. A reader thread for each pipe copies the
+    bytes into a ByteCaptureBuffer as they arrive, and echoes them to the
+    original descriptor when asked. Hold _fd_capture_lock while using one."""
+    def __init__(self, stdout: ByteCaptureBuffer, stderr: ByteCaptureBuffer,
+                 echo_out: bool = False, echo_err: bool = False):
+        self._targets = {1: (stdout, echo_out), 2: (stderr, echo_err)}
+        self._saved = {}
+        self._readers = []
+        self._buffered = set()
+
+    def __enter__(self):
+        try:
+            _flush_std_streams()
+            # Python level writes keep their buffering where they can
+            self._buffered = {fd for fd, stream in ((1, sys.stdout), (2, sys.stderr))
+                              if _stream_fd(stream) == fd}
+            for fd, (buffer, echo) in self._targets.items():
+                read_fd, write_fd = os.pipe()
+                self._saved[fd] = os.dup(fd)
+                os.dup2(write_fd, fd)
+                os.close(write_fd)
+                reader = threading.Thread(
+                    target=self._drain,
+                    args=(read_fd, buffer, self._saved[fd] if echo else None),
+                    daemon=True
+                )
+                reader.start()
+                self._readers.append(reader)
+        except BaseException:
+            self._restore()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        self._restore()
+
+    @staticmethod
+    def _drain(read_fd: int, buffer: ByteCaptureBuffer, echo_fd: int):
+        try:
+            while True:
+                data = os.read(read_fd, 1 << 16)
+                if not data:
+                    break
+                buffer.write(data)
+                if echo_fd is not None:
+                    try:
+                        _write_fd(echo_fd, data)
+                    except OSError:
+                        echo_fd = None
+        finally:
+            os.close(read_fd)
+
+    def _restore(self):
+        try:
+            _flush_std_streams()
+            for fd, saved in self._saved.items():
+                os.dup2(saved, fd)
+            # The pipes only close once every copy of them is gone, so a
+            # subprocess left running keeps its reader going
+            for reader in self._readers:
+                reader.join(TERMINATE_GRACE)
+            for reader, saved in zip(self._readers, self._saved.values()):
+                if not reader.is_alive():
+                    os.close(saved)
+        finally:
+            self._saved = {}
+            self._readers = []
+
+    def write(self, fd: int, text: str, real_write: Callable = None):
+        """Writes text to a captured file descriptor. real_write is the
+        unpatched write of the matching sys stream. It is used instead when
+        that stream writes to the same descriptor, to keep its buffering."""
+        if real_write is not None and fd in self._buffered:
+            real_write(text)
+        else:
+            _write_fd(fd, text.encode("utf-8", "surrogateescape"))
+
+    def echo(self, fd: int, text: str):
+        """Writes text to where a captured file descriptor used to point"""
+        _write_fd(self._saved[fd], text.encode("utf-8", "surrogateescape"))
+
+
+class ExceptionThread(threading.Thread):
+    """Special form of thread that terminates by raising an exception"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args,**kwargs)
+
+    def get_id(self):
+        """Returns id of the respective thread"""
+        if hasattr(self, '_thread_id'):
+            return self._thread_id
+        #pylint: disable=protected-access
+        for id_, thread in threading._active.items():
+            if thread is self:
+                return id_
+    def terminate(self):
+        """Terminates the thread by raising SystemExit in the thread"""
+        thread_id = self.get_id()
+        res = ctypes.pythonapi.PyThreadState_SetAsyncExc(
+              ctypes.c_ulong(thread_id), ctypes.py_object(SystemExit))
+        if res > 1:
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), None)
+            print('Exception raise failure')
+
+
+class _TaskWorker:
+    """Long-lived worker thread that runs jobs handed to it one at a time"""
+    def __init__(self):
+        self.jobs = queue.SimpleQueue()
+        self.results = queue.SimpleQueue()
+        self.thread = ExceptionThread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def _work(self):
+        # pylint: disable = broad-exception-caught
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                self.results.put((None, job()))
+            except BaseException as exc:
+                # Remove the traces for background functions
+                self.results.put((_exception_state(exc), UnknownValue()))
+
+    def stop(self):
+        """Interrupts the current job and lets the thread exit once it does.
+        Gives up on the thread if it is stuck in C code or a sleep."""
+        self.thread.terminate()
+        try:
+            self.results.get(timeout=TERMINATE_GRACE)
+        except queue.Empty:
+            pass
+        self.jobs.put(None)
+
+
+class TestExecutor:
+    """Keeps warm worker threads around so timed tests don't pay for a new
+    thread on every run. A worker is only replaced after it is stopped for
+    timing out. Can be shared by any number of UnitTestPacks and used as a
+    context manager to shut the workers down when done."""
+    def __init__(self):
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def run(self, job: Callable, timeout: float):
+        """Runs job on a worker thread and returns its return value.
+        Raises TestTimeoutError if it does not finish within timeout seconds,
+        or the job's own exception if it raised one."""
+        with self._lock:
+            worker = None
+            while self._idle and worker is None:
+                worker = self._idle.pop()
+                if not worker.thread.is_alive():
+                    worker = None
+        if worker is None:
+            worker = _TaskWorker()
+
+        worker.jobs.put(job)
+        try:
+            exception, rval = worker.results.get(timeout=float(timeout))
+        except queue.Empty:
+            # Recycle the worker, it may still be busy with the old job
+            worker.stop()
+            raise TestTimeoutError("Test timed out.") from None
+
+        with self._lock:
+            if self._closed:
+                worker.jobs.put(None)
+            else:
+                self._idle.append(worker)
+        if exception is not None:
+            raise exception[0](exception[1])
+        return rval
+
+    def shutdown(self):
+        """Stops all idle workers. Workers still running a job stop after it."""
+        with self._lock:
+            self._closed = True
+            for worker in self._idle:
+                worker.jobs.put(None)
+            self._idle = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+_DEFAULT_EXECUTOR = None
+# Number of running tests that need tracemalloc
+_memory_tracers = 0
+_memory_lock = threading.Lock()
+
+
+class StackSampler:
+    """Records the stack of one thread every interval seconds from a thread of
+    its own, counting how often each stack is seen. Unlike a tracing profiler
+    it costs the sampled thread nothing and still sees a thread that is stuck
+    in C code or was abandoned after a timeout. Frames below root_code, such
+    as the code that called the test, are left out."""
+    def __init__(self, interval: float = 0.005, root_code=None):
+        self.interval = interval
+        self.root_code = root_code
+        # Set once the thread to sample is known
+        self.thread_id = None
+        self.counts = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="StackSampler",
+                                        daemon=True)
+
+    def start(self):
+        """Starts sampling and returns self"""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops sampling"""
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        counts = self.counts
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable = protected-access
+            stack = []
+            while frame is not None and frame.f_code is not self.root_code:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                stack = tuple(stack)
+                counts[stack] = counts.get(stack, 0) + 1
+
+    def collapsed(self) -> str:
+        """The samples as collapsed stacks, one "outer;...;inner count" line
+        per stack, the format read by flame graph tools"""
+        lines = []
+        for stack, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+            frames = ";".join(
+                f"{getattr(code, 'co_qualname', code.co_name)} "
+                f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                for code in reversed(stack)
+            )
+            lines.append(f"{frames} {count}\n")
+        return "".join(lines)
+
+
+class QuietReporter:
+    """Collects results while quiet mode is on. Tests only hand over their
+    results, so nothing is formatted or written until write_summary is
+    called. Only the first max_failures failures are kept."""
+    def __init__(self, max_failures: int = 100):
+        self.max_failures = max_failures
+        self.passed = 0
+        self.failed = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, passed: bool, diff, exception):
+        """Records the result of a test run"""
+        with self._lock:
+            if passed:
+                self.passed += 1
+                return
+            self.failed += 1
+            if len(self.failures) < self.max_failures:
+                self.failures.append((name, diff, exception))
+
+    def summary(self) -> str:
+        """Text listing the number of tests passed and each failure"""
+        lines = [f"{self.passed}/{self.passed + self.failed} Tests Passed"]
+        for name, diff, exception in self.failures:
+            lines.append(f"{Tcolors.fg.red}Failed: {name}{Tcolors.default}")
+            if exception is not None:
+                lines.append(f"{exception.__class__.__name__}: {exception}")
+            elif diff is not None:
+                lines.append(diff.diff_str)
+        if self.failed > len(self.failures):
+            lines.append(f"...and {self.failed - len(self.failures)} more failures")
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, stream=None):
+        """Writes the summary to stream (sys.stdout by default) in one go"""
+        (sys.stdout if stream is None else stream).write(self.summary())
+
+
+_quiet_reporter = None
+
+def set_quiet(enabled: bool = True, max_failures: int = 100):
+    """Turns quiet mode on or off for every UnitTestPack. In quiet mode tests
+    print nothing at all: no banners, results or diffs, and input and output
+    aren't echoed even with print_input, print_out or print_err. Results go
+    to the returned QuietReporter instead, which keeps the first max_failures
+    failures. Returns None when turned off."""
+    global _quiet_reporter  # pylint: disable = global-statement
+    _quiet_reporter = QuietReporter(max_failures) if enabled else None
+    return _quiet_reporter
+
+
+def quiet_reporter():
+    """Returns the QuietReporter of quiet mode, or None if it's off"""
+    return _quiet_reporter
+
+def default_executor() -> TestExecutor:
+    """Returns the TestExecutor shared by UnitTestPacks without their own"""
+    global _DEFAULT_EXECUTOR  # pylint: disable = global-statement
+    if _DEFAULT_EXECUTOR is None:
+        _DEFAULT_EXECUTOR = TestExecutor()
+    return _DEFAULT_EXECUTOR
+
+
+# Test capturing I/O in the current thread or asyncio task. _NOT_CAPTURED
+# marks code that runs tests, such as UnitTestPack.__call__ itself.
+_active_test = contextvars.ContextVar("active_test", default=None)
+_NOT_CAPTURED = object()
+# Returned by next() once a test's user_input runs out
+_NO_INPUT = object()
+# All tests currently capturing I/O. A test leaves it when its run ends, even
+# if its thread was abandoned after a timeout and is still running. Writes
+# from threads that don't belong to a running test go to the test only if it
+# is the only one running.
+_running_tests = set()
+_io_lock = threading.Lock()
+# Original write functions of the patched streams
+_real_writes = {}
+_real_input = builtins.input
+# Thread.start from before it was patched, while tests are running
+_real_thread_start = None
+# runs_tests is set on threads that run tests or their functions. They never
+# capture writes for a test that isn't their own.
+_thread_state = threading.local()
+
+
+def _find_active_test():
+    """Returns the test capturing I/O for the current thread or task"""
+    test = _active_test.get()
+    if test is _NOT_CAPTURED:
+        return None
+    if test is not None and test in _running_tests:
+        return test
+    # Such as a pool thread started before the test, or by an earlier one
+    if getattr(_thread_state, "runs_tests", False):
+        return None
+    with _io_lock:
+        if len(_running_tests) == 1:
+            return next(iter(_running_tests))
+    return None
+
+
+def _start_thread_in_context(thread: threading.Thread):
+    """Replacement for Thread.start while tests are running. Threads started
+    by a test run in a copy of its context, so their I/O goes to the same
+    test even when other tests are running."""
+    test = _active_test.get()
+    if test is not None and test is not _NOT_CAPTURED:
+        context = contextvars.copy_context()
+        run = thread.run
+        thread.run = lambda: context.run(run)
+    return _real_thread_start(thread)
+
+
+def _add_running_test(test):
+    """Starts routing I/O to a test. Thread.start is patched while any test
+    is running."""
+    global _real_thread_start  # pylint: disable = global-statement
+    _thread_state.runs_tests = True
+    with _io_lock:
+        if not _running_tests and threading.Thread.start is not _start_thread_in_context:
+            _real_thread_start = threading.Thread.start
+            threading.Thread.start = _start_thread_in_context
+        _running_tests.add(test)
+
+
+def _discard_running_test(test):
+    """Stops routing I/O to a test, and puts Thread.start back once no test
+    is running"""
+    with _io_lock:
+        _running_tests.discard(test)
+        if not _running_tests and threading.Thread.start is _start_thread_in_context:
+            threading.Thread.start = _real_thread_start
+
+
+def _dispatch_input(prompt: str = ""):
+    """Replacement for input() that feeds the active test's user_input"""
+    test = _find_active_test()
+    if test is None:
+        return _real_input(prompt)
+    return test._fake_input(prompt, _real_writes["stdout"])  # pylint: disable = protected-access
+
+
+def _make_dispatch_write(name: str, real_write: Callable):
+    def dispatch_write(text):
+        test = _find_active_test()
+        if test is None:
+            return real_write(text)
+        if name == "stdout":
+            test._capture_stdout(text, real_write)  # pylint: disable = protected-access
+        else:
+            test._capture_stderr(text, real_write)  # pylint: disable = protected-access
+        return len(text)
+    dispatch_write.is_test_dispatch = True
+    return dispatch_write
+
+
+def _install_io_hooks():
+    """Patches sys.stdout, sys.stderr and input() so they route to the test
+    running on the current thread or task. The patches stay in place, so this
+    only does work the first time or when a stream has been replaced."""
+    # pylint: disable = global-statement
+    global _real_input
+    with _io_lock:
+        for name in ("stdout", "stderr"):
+            stream = getattr(sys, name)
+            if getattr(stream.write, "is_test_dispatch", False):
+                continue
+            _real_writes[name] = stream.write
+            stream.write = _make_dispatch_write(name, stream.write)
+        if builtins.input is not _dispatch_input:
+            _real_input = builtins.input
+            builtins.input = _dispatch_input
+
+
+class _PipeStream:
+    """Stream used inside an isolated test process that forwards everything
+    written to it to the parent process, tagged with the stream it came from.
+    """
+    def __init__(self, conn, tag: str):
+        self.conn = conn
+        self.tag = tag
+
+    def write(self, text: str):
+        """Sends text to the parent process"""
+        self.conn.send((self.tag, text))
+        return len(text)
+
+    def flush(self):
+        """Nothing is buffered"""
+
+    def getvalue(self) -> str:
+        """Output lives in the parent process"""
+        return ""
+
+    def close(self):
+        """The connection is owned by the test process"""
+
+
+def _exception_state(exc: BaseException, skip: int = 2):
+    """Packs an exception raised in a background test with its traceback,
+    leaving out the first few frames that belong to the test tools."""
+    tb_stack = traceback.extract_tb(exc.__traceback__)[skip:]
+    return (
+        type(exc),
+        f"{exc}\n\nOriginal Traceback (most recent call last):\n"
+        f"{''.join(traceback.format_list(tb_stack))}"
+        f"{exc.__class__.__name__}: {exc}",
+    )
+
+class UnitTestPack:
+    """Packs a Callable object with it's arguments so it can all be
+    transported together."""
+    #pylint: disable = attribute-defined-outside-init
+
+    # Defaults, shared by every test until it is configured otherwise so a
+    # test only stores the settings it changes
+    name = "Untitled"
+    timeout = 10
+    _user_input = ()
+    _inputs = iter(())
+    capture_input = True
+    print_input = True
+    print_out = True
+    print_err = True
+    expect_out = None
+    expect_err = None
+    expect_rval = UnknownValue()
+    expect_success = True
+    capture_limit = None
+    capture_spill = None
+    isolation = "thread"
+    capture_mode = "sys"
+    executor = None
+    render_diff = True
+    measure_memory = False
+    expect_max_time = None
+    expect_max_cpu = None
+    expect_max_memory = None
+    track_calls = False
+    fail_fast = False
+    profile = False
+    profile_slow = None
+    profile_dir = "profiles"
+    # File name of the test's profiles, without an extension. Defaults to
+    # the test's name.
+    profile_name = None
+
+    # Results before the first run
+    _stdout = _stderr = CaptureBuffer(limit=0)
+    _rval = UnknownValue()
+    _success = False
+    _diff = None
+    _exception = None
+    _timing = (None, None, None)
+    _touched = frozenset()
+    _started = 0.0
+    _out_checked = 0
+    _out_mismatch = False
+    _reporter = None
+    _fd_capture = None
+    _sampler = None
+    _profile_file = None
+
+    def __init__(self, func: Callable, *args, **kwds):
+        # Pack function
+        self.func = func
+        self.args = args
+        self.kwds = kwds
+
+    def reset_results(self):
+        """Resets results and is called before each run."""
+        for buffer in (getattr(self, "_stdout", None), getattr(self, "_stderr", None)):
+            if buffer is not None:
+                buffer.close()
+        self._stdout = self._new_buffer(self.capture_limit, self.capture_spill)
+        self._stderr = self._new_buffer(self.capture_limit, self.capture_spill)
+        self._rval = UnknownValue()
+        self._success = False
+        self._diff = None
+        self._exception = None
+        self._timing = (None, None, None)
+        self._touched = set()
+        self._started = time.perf_counter()
+        self._out_checked = 0
+        self._out_mismatch = False
+        self._profile_file = None
+
+    def _new_buffer(self, limit: int = None, spill: int = None) -> CaptureBuffer:
+        if self.capture_mode == "fd":
+            return ByteCaptureBuffer(limit, spill)
+        return CaptureBuffer(limit, spill)
+
+    # Read only properties
+    @property
+    def stdout(self):
+        """stdout is a read only property"""
+        return self._stdout.getvalue()
+
+    @property
+    def stderr(self):
+        """stderr is a read only property"""
+        return self._stderr.getvalue()
+
+    @property
+    def raw_stdout(self) -> bytes:
+        """Captured stdout as bytes. Read only. With capture_mode "fd" these
+        are the exact bytes written, otherwise the text encoded as UTF-8."""
+        if isinstance(self._stdout, ByteCaptureBuffer):
+            return self._stdout.getbytes()
+        return self.stdout.encode("utf-8", "surrogatepass")
+
+    @property
+    def raw_stderr(self) -> bytes:
+        """Captured stderr as bytes. Read only."""
+        if isinstance(self._stderr, ByteCaptureBuffer):
+            return self._stderr.getbytes()
+        return self.stderr.encode("utf-8", "surrogatepass")
+
+    @property
+    def profile_file(self):
+        """Profile written by the last run, or None. Read only."""
+        return self._profile_file
+
+    @property
+    def rval(self):
+        """rval is a read only property"""
+        return self._rval
+
+    @property
+    def success(self):
+        """Success is a read only property"""
+        return self._success
+
+    @property
+    def diff_str(self):
+        """diff_str is a read only property. It is rendered the first time
+        it is read."""
+        if self._diff is None:
+            return None
+        return self._diff.diff_str
+
+    @property
+    def exception(self):
+        """Exception is a read only property"""
+        return self._exception
+
+    @property
+    def touched_code(self) -> frozenset:
+        """(filename, qualified name) of every Python function called while
+        the test ran. Only recorded with track_calls. Read only."""
+        return frozenset(self._touched)
+
+    @property
+    def metrics(self) -> TestMetrics:
+        """Cost of the last run. Read only."""
+        wall_time, cpu_time, peak_memory = self._timing
+        return TestMetrics(wall_time, cpu_time, peak_memory,
+                           self._stdout.nbytes, self._stderr.nbytes)
+
+    def config(self,
+               name: str = None,
+               timeout: int = None,
+               user_input: Iterable = None,
+               user_input_file: str = None,
+               print_input: bool = None,
+               capture_input: bool = None,
+               print_out: bool = None,
+               print_err: bool = None,
+               expect_out: str|list[str] = None,
+               expect_err: str|list[str] = None,
+               expect_rval: Any = UnknownValue(),
+               expect_success: bool = None,
+               capture_limit: int = None,
+               capture_spill: int = None,
+               isolation: str = None,
+               capture_mode: str = None,
+               executor: TestExecutor = None,
+               render_diff: bool = None,
+               measure_memory: bool = None,
+               expect_max_time: float = None,
+               expect_max_cpu: float = None,
+               expect_max_memory: int = None,
+               track_calls: bool = None,
+               fail_fast: bool = None,
+               profile: bool = None,
+               profile_slow: float = None,
+               profile_dir: str = None
+               ):
+        """Configures the attributes of the class and returns self.
+        Use for inline test configurations.\n
+        Please use "set_args" to change function arguments after creation.
+        """
+        if name is not None:
+            self.name = name
+        if not isinstance(expect_rval, UnknownValue):
+            self.expect_rval = expect_rval
+        if timeout is not None:
+            self.timeout = timeout
+        if user_input is not None:
+            self.user_input = user_input
+        if user_input_file is not None:
+            self.user_input_file = user_input_file
+        if print_input is not None:
+            self.print_input = print_input
+        if capture_input is not None:
+            self.capture_input = capture_input
+        if expect_out is not None:
+            if isinstance(expect_out, str):
+                self.expect_out = expect_out
+            elif isinstance(expect_out, Iterable):
+                self.expect_out = '\n'.join(str(x) for x in expect_out) + '\n'
+            else:
+                self.expect_out = str(expect_out)
+        if expect_err is not None:
+            if isinstance(expect_err, str):
+                self.expect_err = expect_err
+            elif isinstance(expect_err, Iterable):
+                self.expect_err = ''.join(str(x) + '\n' for x in expect_err)
+            else:
+                self.expect_err = str(expect_err)
+        if print_out is not None:
+            self.print_out = print_out
+        if print_err is not None:
+            self.print_err = print_err
+        if expect_success is not None:
+            self.expect_success = expect_success
+        if capture_limit is not None:
+            self.capture_limit = capture_limit if capture_limit > 0 else None
+        if capture_spill is not None:
+            self.capture_spill = capture_spill if capture_spill > 0 else None
+        if isolation is not None:
+            if isolation not in ("thread", "process"):
+                raise ValueError(f'Unknown isolation "{isolation}". '
+                                 'Use "thread" or "process".')
+            self.isolation = isolation
+        if capture_mode is not None:
+            if capture_mode not in ("sys", "fd"):
+                raise ValueError(f'Unknown capture_mode "{capture_mode}". '
+                                 'Use "sys" or "fd".')
+            self.capture_mode = capture_mode
+        if executor is not None:
+            self.executor = executor
+        if render_diff is not None:
+            self.render_diff = render_diff
+        if measure_memory is not None:
+            self.measure_memory = measure_memory
+        if expect_max_time is not None:
+            self.expect_max_time = expect_max_time if expect_max_time > 0 else None
+        if expect_max_cpu is not None:
+            self.expect_max_cpu = expect_max_cpu if expect_max_cpu > 0 else None
+        if expect_max_memory is not None:
+            self.expect_max_memory = expect_max_memory if expect_max_memory > 0 else None
+        if track_calls is not None:
+            self.track_calls = track_calls
+        if fail_fast is not None:
+            self.fail_fast = fail_fast
+        if profile is not None:
+            self.profile = profile
+        if profile_slow is not None:
+            self.profile_slow = profile_slow if profile_slow > 0 else None
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+        return self
+
+    @property
+    def user_input(self):
+        """Get user_input that replaces calls to
+        input() when the function is run."""
+        return self._user_input
+
+    @user_input.setter
+    def user_input(self, values: Iterable):
+        """Set user input to replace calls to input() with
+        when the function is run. Lists and tuples are copied, while other
+        iterables such as ranges, generators and InputFiles are read one
+        value at a time as the function asks for them."""
+        if isinstance(values,str):
+            self._user_input = (values,)
+        elif hasattr(values, "__aiter__"):
+            # Async feeds are read while the test runs
+            self._user_input = values
+        elif isinstance(values,(list,tuple)):
+            self._user_input = tuple(values)
+        elif isinstance(values,Iterable):
+            self._user_input = values
+        else:
+            self._user_input = (str(values),)
+
+    @property
+    def user_input_file(self):
+        """Name of the file user_input is read from, or None"""
+        if isinstance(self._user_input, InputFile):
+            return self._user_input.filename
+        return None
+
+    @user_input_file.setter
+    def user_input_file(self, filename):
+        """Read user input from a file, one line per call to input()"""
+        self._user_input = InputFile(filename) if filename is not None else ()
+
+    def get_diff(self) -> DiffResult:
+        """Get difference in output of the test function from the expected 
+        output provided to the class. The diff text is only rendered when
+        diff_str is read from the result.
+        """
+        mismatches = []
+        if not isinstance(self.expect_rval, UnknownValue):
+            if self.rval != self.expect_rval:
+                mismatches.append(("Return Value", self.rval, self.expect_rval))
+        if self.expect_out is not None:
+            stdout = self.stdout
+            if stdout != self.expect_out:
+                mismatches.append(("Standard Output", stdout, self.expect_out))
+        if self.expect_err is not None:
+            stderr = self.stderr
+            if stderr != self.expect_err:
+                mismatches.append(("Error Output", stderr, self.expect_err))
+
+        # Soft performance budgets
+        over_budget = {}
+        budgets = {}
+        wall_time, cpu_time, peak_memory = self._timing
+        for label, value, limit, unit in (
+            ("Wall time", wall_time, self.expect_max_time, "s"),
+            ("CPU time", cpu_time, self.expect_max_cpu, "s"),
+            ("Peak memory", peak_memory, self.expect_max_memory, "B"),
+        ):
+            if limit is not None and value is not None and value > limit:
+                if unit == "s":
+                    over_budget[label] = f"{value:.3f} s"
+                    budgets[label] = f"{limit:.3f} s"
+                else:
+                    over_budget[label] = f"{value} B"
+                    budgets[label] = f"{limit} B"
+        if over_budget:
+            mismatches.append(("Performance", over_budget, budgets))
+        return DiffResult(not mismatches, mismatches, self.render_diff)
+
+    def set_args(self, *args, **kwds):
+        """Set or change the arguments passed into the function by default.
+        Returns self for further inline configuration.
+        """
+        self.args = args
+        self.kwds = kwds
+        return self
+
+    def __call__(self) -> Any:
+        # Output printed while running the test is never captured by a test
+        token = _active_test.set(_NOT_CAPTURED)
+        _thread_state.runs_tests = True
+        try:
+            return self._run_test()
+        finally:
+            _active_test.reset(token)
+
+    run = __call__
+
+    def _run_test(self) -> Any:
+        #pylint: disable = broad-exception-caught
+        with self._fd_lock():
+            self._begin_run()
+            if self.profile_slow is not None and self.isolation == "thread":
+                self._sampler = StackSampler(
+                    root_code=UnitTestPack._run_in_main.__code__).start()
+            try:
+                with self._capture_fds():
+                    self._execute()
+            except Exception as exc:
+                self._record_exception(exc)
+            finally:
+                self._fd_capture = None
+                # A thread abandoned after a timeout no longer captures
+                _discard_running_test(self)
+            return self._end_run()
+
+    def _execute(self):
+        """Runs the function with the configured isolation and timeout"""
+        if self.isolation == "process":
+            # Always run in a child process that can be killed
+            self._run_in_process()
+        # if the timeout is not set or one of the specified debuggers is
+        # debugging this code, run in main thread
+        elif (
+            self.timeout is None
+            or self.timeout <= 0
+
+            ## This was here to allow debugger to run without timing out
+            ## but VSCode's Pytest tool updated so it's always in debug mode.
+
+            # or "pydevd" in sys.modules
+            # or "pdb" in sys.modules
+        ):
+            self._run_in_main()
+        else:
+            # Otherwise, run in a timed thread
+            self._run_as_task()
+
+    def _fd_lock(self):
+        """Lock that runs capture_mode "fd" tests one at a time"""
+        if self.capture_mode != "fd":
+            return contextlib.nullcontext()
+        return _fd_capture_lock
+
+    def _capture_fds(self):
+        """Context that captures the standard file descriptors for a run in
+        capture_mode "fd", otherwise one that does nothing"""
+        if self.capture_mode != "fd":
+            return contextlib.nullcontext()
+        self._fd_capture = FdCapture(
+            self._stdout, self._stderr,
+            echo_out=self.print_out and self._reporter is None,
+            echo_err=self.print_err and self._reporter is None,
+        )
+        return self._fd_capture
+
+    def benchmark(self, repeat: int = 10, warmup: int = 1) -> BenchmarkResult:
+        """Runs the test once as usual to check its results, then runs the
+        function warmup more times followed by repeat timed runs. Nothing is
+        printed or compared on the extra runs and the results of the checked
+        run are kept. A timed run that raises stops the benchmark. Nothing is
+        timed if the checked run fails or raises."""
+        self()
+        if not self.success or self.exception is not None:
+            return BenchmarkResult(self.name, self.success, 0, None, None, None, None, None)
+
+        saved = (self._stdout, self._stderr, self._rval, self._timing)
+        printing = (self.print_input, self.print_out, self.print_err, self.fail_fast,
+                    self.profile)
+        self.print_input = self.print_out = self.print_err = self.fail_fast = False
+        self.profile = False
+        samples = []
+        try:
+            for run in range(warmup + repeat):
+                # Keep nothing from the output, only count it
+                self._stdout = self._new_buffer(limit=0)
+                self._stderr = self._new_buffer(limit=0)
+                self._timing = (None, None, None)
+                try:
+                    with self._fd_lock(), self._capture_fds():
+                        self._execute()
+                finally:
+                    self._fd_capture = None
+                    _discard_running_test(self)
+                if run >= warmup:
+                    samples.append(self._timing[0])
+        finally:
+            (self.print_input, self.print_out, self.print_err, self.fail_fast,
+             self.profile) = printing
+            self._stdout, self._stderr, self._rval, self._timing = saved
+
+        samples.sort()
+        return BenchmarkResult(
+            self.name, True, len(samples),
+            samples[0],
+            statistics.median(samples),
+            samples[max(math.ceil(len(samples) * 0.95) - 1, 0)],
+            statistics.fmean(samples),
+            statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        )
+
+    def _begin_run(self):
+        # Quiet mode is checked once per run to keep it out of the I/O hooks
+        self._reporter = _quiet_reporter
+        if self._reporter is None:
+            print(f"{Tcolors.fg.blue}\tRunning test: {self.name} ...{Tcolors.default}")
+        self.reset_results()
+
+    def _record_exception(self, exc: Exception):
+        if isinstance(exc, OutputMismatchError):
+            # A plain failure, shown with the output diff
+            return
+        if self._reporter is None:
+            print(f"{Tcolors.fg.red}{exc.__class__.__name__}: {exc}{Tcolors.default}")
+            print()
+        self._exception = exc
+
+    def _end_run(self) -> Any:
+        if self._timing[0] is None:
+            # Didn't finish, such as after a timeout
+            self._timing = (time.perf_counter() - self._started, None, None)
+        if self._sampler is not None:
+            self._save_samples()
+        if self._profile_file is not None and self._reporter is None:
+            print(f"{Tcolors.fg.dgray}\tProfile saved to {self._profile_file}{Tcolors.default}")
+        if self.exception is None:
+            self._diff = self.get_diff()
+            self._success = self._diff.success
+
+        passed = self.success == self.expect_success
+        self._success = passed
+        if self._reporter is not None:
+            self._reporter.add(self.name, passed, self._diff, self.exception)
+        elif passed:
+            print(f"{Tcolors.fg.green}Success{Tcolors.default}")
+        else:
+            print(f"{Tcolors.fg.red}Failed{Tcolors.default}")
+            if self.exception is None:
+                print(self.diff_str)
+        if not passed and self.exception is not None:
+            raise self.exception
+        return self.rval
+
+    def _fake_input(self, prompt: str, real_stdout_write: Callable):
+        """Returns the next user input in place of input()"""
+        if hasattr(self._user_input, "__aiter__"):
+            rval = self._next_async_input()
+        else:
+            rval = next(self._inputs, _NO_INPUT)
+            if rval is _NO_INPUT:
+                raise UnexpectedInputError("Program is asking for too many inputs!")
+            rval = str(rval)
+        if self.print_input and self._fd_capture is not None:
+            if self.capture_input:
+                # Echoed along with the rest of the output if print_out is on
+                self._fd_capture.write(1, f"{prompt}{rval}\n", real_stdout_write)
+            elif self._reporter is None:
+                self._fd_capture.echo(1, f"{Tcolors.fg.dcyan}{prompt}"
+                                         f"{Tcolors.underline}{rval}{Tcolors.default}\n")
+        elif self.print_input:
+            if self.capture_input:
+                self._stdout.write(f"{prompt}{rval}\n")
+            if self._reporter is None:
+                real_stdout_write(
+                    f"{'' if self.capture_input else Tcolors.fg.dcyan}{prompt}"
+                    f"{Tcolors.underline}{rval}"
+                    f"{Tcolors.default}\n")
+            if self.capture_input and self.fail_fast and self.expect_out is not None:
+                self._check_output(f"{prompt}{rval}\n")
+        return rval
+
+    def _next_async_input(self) -> str:
+        raise UnitTestError("Async user_input feeds need an AsyncUnitTestPack.")
+
+    def _capture_stdout(self, text: str, real_stdout_write: Callable):
+        """
+        Copies output to the stdout buffer and then passes
+        the output to the original write function
+        """
+        if self._fd_capture is not None:
+            self._fd_capture.write(1, text, real_stdout_write)
+            return
+        self._stdout.write(text)
+        if self.print_out and self._reporter is None:
+            real_stdout_write(text)
+        if self.fail_fast and self.expect_out is not None:
+            self._check_output(text)
+
+    def _check_output(self, text: str):
+        """Compares newly written output with the matching part of
+        expect_out and stops the test at the first difference, including
+        output past the end of expect_out"""
+        start = self._out_checked
+        self._out_checked = start + len(text)
+        if self._out_mismatch or self.expect_out[start:self._out_checked] != text:
+            # Keep failing in case the function catches the first one
+            self._out_mismatch = True
+            raise OutputMismatchError(
+                f"Output stopped matching expect_out within characters "
+                f"{start}-{self._out_checked}."
+            )
+
+    def _capture_stderr(self, text: str, real_stderr_write: Callable):
+        """
+        Copies error output to the stderr buffer and then passes
+        the output to the original write function
+        """
+        if self._fd_capture is not None:
+            self._fd_capture.write(2, text, real_stderr_write)
+            return
+        self._stderr.write(text)
+        if self.print_err and self._reporter is None:
+            real_stderr_write(Tcolors.fg.dmagenta + text + Tcolors.default)
+
+    def _start_measuring(self):
+        # pylint: disable = global-statement
+        global _memory_tracers
+        self._measuring_memory = self.measure_memory or self.expect_max_memory is not None
+        if self._measuring_memory:
+            with _memory_lock:
+                if _memory_tracers == 0:
+                    tracemalloc.start()
+                else:
+                    # Shared with other running tests
+                    tracemalloc.reset_peak()
+                _memory_tracers += 1
+            self._memory_start = tracemalloc.get_traced_memory()[0]
+        self._cpu_start = time.thread_time()
+        self._wall_start = time.perf_counter()
+
+    def _stop_measuring(self, measure_cpu: bool = True):
+        # pylint: disable = global-statement
+        global _memory_tracers
+        wall_time = time.perf_counter() - self._wall_start
+        cpu_time = time.thread_time() - self._cpu_start if measure_cpu else None
+        peak_memory = None
+        if self._measuring_memory:
+            with _memory_lock:
+                peak_memory = max(tracemalloc.get_traced_memory()[1] - self._memory_start, 0)
+                _memory_tracers -= 1
+                if _memory_tracers == 0:
+                    tracemalloc.stop()
+        self._timing = (wall_time, cpu_time, peak_memory)
+
+    def _make_call_tracer(self, previous_trace: Callable):
+        """Returns a trace function that records the code of each call and
+        hands every event on to the trace function that was already set"""
+        touched = self._touched
+        tools_globals = globals()
+        def trace_calls(frame, event, arg):
+            # Calls into the test tools themselves are left out
+            if event == "call" and frame.f_globals is not tools_globals:
+                code = frame.f_code
+                touched.add((code.co_filename, getattr(code, "co_qualname", code.co_name)))
+            if previous_trace is not None:
+                return previous_trace(frame, event, arg)
+            return None
+        return trace_calls
+
+    def _start_inputs(self):
+        """Starts reading user_input from its first value"""
+        if hasattr(self._user_input, "__aiter__"):
+            self._async_inputs = aiter(self._user_input)
+        else:
+            self._inputs = iter(self._user_input)
+
+    def _stop_inputs(self):
+        """Closes the reader of user_input, such as an InputFile's mapping.
+        Iterators passed in by the user are left open for the next run."""
+        inputs = self.__dict__.pop("_inputs", None)
+        if inputs is not None and inputs is not self._user_input and hasattr(inputs, "close"):
+            inputs.close()
+
+    def _profile_path(self, extension: str) -> str:
+        """Where a profile of this test is saved"""
+        stem = re.sub(r"[^\w.-]+", "_", self.profile_name or self.name).strip("._")
+        return os.path.join(self.profile_dir, (stem or "test") + extension)
+
+    def _start_profiler(self):
+        """Starts profiling the current thread with cProfile if profile is
+        on. Returns the profiler, or None."""
+        if not self.profile:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running, such as in a debugger
+            return None
+        return profiler
+
+    def _save_profile(self, profiler: cProfile.Profile):
+        profiler.disable()
+        path = self._profile_path(".pstats")
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(path)
+        self._profile_file = path
+
+    def _save_samples(self):
+        """Stops the stack sampler and saves what it saw if the run was slow
+        or timed out"""
+        sampler, self._sampler = self._sampler, None
+        sampler.stop()
+        slow = (self._timing[0] >= self.profile_slow
+                or isinstance(self.exception, TestTimeoutError))
+        if slow and sampler.counts:
+            path = self._profile_path(".collapsed")
+            os.makedirs(self.profile_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(sampler.collapsed())
+            self._profile_file = path
+
+    def _run_in_main(self):
+        # Route input and output from this thread or task to this test
+        _install_io_hooks()
+        self._start_inputs()
+        token = _active_test.set(self)
+        _add_running_test(self)
+        if self._sampler is not None:
+            self._sampler.thread_id = threading.get_ident()
+
+        previous_trace = sys.gettrace()
+        if self.track_calls:
+            sys.settrace(self._make_call_tracer(previous_trace))
+        profiler = self._start_profiler()
+        self._start_measuring()
+        try:
+            # Breakpoint here to hold the debugger in a timed function
+            self._rval = self.func(*self.args, **self.kwds)
+            if inspect.iscoroutine(self._rval):
+                # Coroutine functions get an event loop of their own
+                self._rval = asyncio.run(self._rval)
+        finally:
+            # Stop capturing, even if there's an error
+            self._stop_measuring()
+            if profiler is not None:
+                self._save_profile(profiler)
+            if self.track_calls:
+                sys.settrace(previous_trace)
+            self._stop_inputs()
+            _discard_running_test(self)
+            _active_test.reset(token)
+
+        return self.rval
+
+    def _run_as_task(self):
+        # Run on a warm worker thread, which is replaced if this times out
+        executor = self.executor or default_executor()
+        return executor.run(self._run_in_main, self.timeout)
+
+    def _start_process(self, conn, parent_pid):
+        """Runs the test inside an isolated child process and sends the
+        results back to the parent through conn."""
+        # pylint: disable = broad-exception-caught
+        _die_with_parent(parent_pid)
+        if self._fd_capture is None:
+            sys.stdout = _PipeStream(conn, "out")
+            sys.stderr = _PipeStream(conn, "err")
+            self._stdout = _PipeStream(conn, "stdout")
+            self._stderr = _PipeStream(conn, "stderr")
+        # Otherwise the output goes to the parent's pipes through the
+        # inherited file descriptors
+        exception_state = None
+        try:
+            self._run_in_main()
+        except BaseException as exc:
+            exception_state = _exception_state(exc)
+        if self._fd_capture is not None:
+            _flush_std_streams()
+        try:
+            conn.send(("result", (exception_state, self.rval, self._timing, self._touched,
+                                  self._profile_file)))
+        except Exception as exc:
+            # The exception type or return value could not be pickled
+            conn.send(("result", (
+                (UnitTestError, f"Could not send test results back: {exc}"),
+                UnknownValue(), self._timing, self._touched, self._profile_file
+            )))
+
+    def _run_in_process(self):
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        recv_conn, send_conn = context.Pipe(duplex=False)
+        proc = context.Process(target=self._start_process,
+                               args=(send_conn, os.getpid()),
+                               daemon=True)
+        deadline = None
+        if self.timeout is not None and self.timeout > 0:
+            deadline = time.monotonic() + float(self.timeout)
+
+        proc.start()
+        send_conn.close()
+        results = None
+        try:
+            while True:
+                wait = None if deadline is None else deadline - time.monotonic()
+                if wait is not None and wait <= 0 or not recv_conn.poll(wait):
+                    break
+                try:
+                    tag, value = recv_conn.recv()
+                except EOFError:
+                    break
+                if tag == "stdout":
+                    self._stdout.write(value)
+                elif tag == "stderr":
+                    self._stderr.write(value)
+                elif tag == "out":
+                    sys.stdout.write(value)
+                elif tag == "err":
+                    sys.stderr.write(value)
+                else:
+                    results = value
+                    break
+        finally:
+            # Hard kill, this works even if the test is stuck in C code
+            if proc.is_alive():
+                proc.kill()
+            proc.join(TERMINATE_GRACE)
+            recv_conn.close()
+
+        if results is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TestTimeoutError("Test timed out.")
+            raise UnitTestError(
+                f"Test process exited unexpectedly (exit code {proc.exitcode})."
+            )
+        exception, self._rval, self._timing, self._touched, self._profile_file = results
+        if exception is not None:
+            raise exception[0](exception[1])
+        return self.rval
+
+# Matching lines shown around each changed hunk by compare_diff
+DIFF_CONTEXT = 3
+# Edit distance after which compare_diff stops searching for the smallest
+# diff and reports the rest of the changed region as one hunk
+DIFF_MAX_EDITS = 500
+
+UNPRINTABLE_CHARS = {
+    "\t":"→",
+    "\n":"↵",
+    "\r":"↩",
+    "\b":"← ",
+    "\v":"↓",
+    "\a":"🕭",
+    "\x00":"␀ ",
+    "\x1B":"␛ ",
+}
+
+def _visible(text: str):
+    """Marks the unprintable characters in text so they can be seen"""
+    if text.isprintable():
+        return text
+    return "".join(
+        char if char.isprintable() else UNPRINTABLE_CHARS.get(char, "•") + char
+        for char in text
+    )
+
+
+def _common_run(seq1: list, seq2: list, start1: int, start2: int, step: int = 1):
+    """Counts how many items match from seq1[start1] and seq2[start2] onwards,
+    or backwards from just before them when step is -1. Compares growing
+    slices so long runs of matching lines are checked at C speed."""
+    if step > 0:
+        limit = min(len(seq1) - start1, len(seq2) - start2)
+    else:
+        limit = min(start1, start2)
+    run = 0
+    size = 1
+    while run < limit and size > 0:
+        size = min(size, limit - run)
+        if step > 0:
+            same = (seq1[start1 + run:start1 + run + size]
+                    == seq2[start2 + run:start2 + run + size])
+        else:
+            same = (seq1[start1 - run - size:start1 - run]
+                    == seq2[start2 - run - size:start2 - run])
+        if same:
+            run += size
+            size *= 2
+        else:
+            size //= 2
+    return run
+
+
+def _myers_diff(seq1: list, seq2: list, max_edits: int):
+    """Finds the shortest edit script between two sequences using Myers'
+    algorithm. Returns a list of (tag, i1, i2, j1, j2) opcodes in the style
+    of difflib, or None if more than max_edits edits are needed."""
+    # pylint: disable = invalid-name
+    len1 = len(seq1)
+    len2 = len(seq2)
+    v = {1: 0}
+    trace = []
+    for d in range(max_edits + 1):
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            if x < len1 and y < len2 and seq1[x] == seq2[y]:
+                run = _common_run(seq1, seq2, x, y)
+                x += run
+                y += run
+            v[k] = x
+            if x >= len1 and y >= len2:
+                break
+        else:
+            continue
+        break
+    else:
+        return None
+
+    # Walk back through the trace to recover the edits, last one first
+    moves = []
+    x, y = len1, len2
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        run = max(min(x - prev_x, y - prev_y), 0)
+        if run:
+            moves.append(("equal", run))
+        x -= run
+        y -= run
+        if d > 0:
+            moves.append(("insert" if x == prev_x else "delete", 1))
+        x, y = prev_x, prev_y
+    moves.reverse()
+
+    # Group the moves into opcodes
+    opcodes = []
+    x = y = 0
+    for move, run in moves:
+        start = (x, y)
+        if move == "equal":
+            x += run
+            y += run
+        elif move == "delete":
+            x += run
+        else:
+            y += run
+        tag = "equal" if move == "equal" else "replace"
+        if opcodes and opcodes[-1][0] == tag:
+            opcodes[-1][2] = x
+            opcodes[-1][4] = y
+        else:
+            opcodes.append([tag, start[0], x, start[1], y])
+    for opcode in opcodes:
+        if opcode[0] == "replace" and opcode[1] == opcode[2]:
+            opcode[0] = "insert"
+        elif opcode[0] == "replace" and opcode[3] == opcode[4]:
+            opcode[0] = "delete"
+    return [tuple(opcode) for opcode in opcodes]
+
+
+def diff_lines(lines1: list, lines2: list):
+    """Compares two lists of lines and returns difflib style opcodes
+    (tag, i1, i2, j1, j2) describing the smallest set of changed hunks."""
+    len1 = len(lines1)
+    len2 = len(lines2)
+    start = _common_run(lines1, lines2, 0, 0)
+    end = _common_run(lines1[start:], lines2[start:], len1 - start, len2 - start, -1)
+    end1 = len1 - end
+    end2 = len2 - end
+
+    # Hash each distinct line to a number so the diff compares integers
+    line_ids = {}
+    new_ids = itertools.count()
+    seq1 = list(map(line_ids.setdefault, lines1[start:end1], new_ids))
+    seq2 = list(map(line_ids.setdefault, lines2[start:end2], new_ids))
+    middle = _myers_diff(seq1, seq2, DIFF_MAX_EDITS)
+    if middle is None:
+        middle = [("replace", 0, len(seq1), 0, len(seq2))]
+
+    opcodes = []
+    if start > 0:
+        opcodes.append(("equal", 0, start, 0, start))
+    for tag, i1, i2, j1, j2 in middle:
+        if i1 == i2 and j1 == j2:
+            continue
+        opcodes.append((tag, i1 + start, i2 + start, j1 + start, j2 + start))
+    if end1 < len1:
+        opcodes.append(("equal", end1, len1, end2, len2))
+    return opcodes
+
+
+class AsyncUnitTestPack(UnitTestPack):
+    """UnitTestPack for coroutine functions. Calling the test returns a
+    coroutine that runs it on the current event loop, so many tests can wait
+    at the same time:\n
+        await asyncio.gather(*(test() for test in tests))\n
+    Timeouts are enforced with asyncio.wait_for and each test captures only
+    the I/O of its own task. user_input may also be an async iterable, which
+    is read by input() calls made off the event loop, such as through
+    asyncio.to_thread(input).
+    """
+    async def __call__(self) -> Any:
+        # Output printed while running the test is never captured by a test
+        token = _active_test.set(_NOT_CAPTURED)
+        try:
+            return await self._run_test_async()
+        finally:
+            _active_test.reset(token)
+
+    run = __call__
+
+    def benchmark(self, repeat: int = 10, warmup: int = 1) -> BenchmarkResult:
+        """Not supported, timing runs on a shared event loop would measure the
+        other tasks too"""
+        raise UnitTestError("AsyncUnitTestPack does not support benchmark.")
+
+    async def _run_test_async(self) -> Any:
+        #pylint: disable = broad-exception-caught
+        self._begin_run()
+        try:
+            if self.isolation == "process":
+                raise UnitTestError("AsyncUnitTestPack does not support process isolation.")
+            if self.capture_mode == "fd":
+                raise UnitTestError('AsyncUnitTestPack does not support capture_mode "fd".')
+            if self.profile or self.profile_slow is not None:
+                raise UnitTestError("AsyncUnitTestPack does not support profiling.")
+            if self.timeout is None or self.timeout <= 0:
+                await self._run_in_task()
+            else:
+                try:
+                    await asyncio.wait_for(self._run_in_task(), float(self.timeout))
+                except asyncio.TimeoutError:
+                    raise TestTimeoutError("Test timed out.") from None
+        except Exception as exc:
+            self._record_exception(exc)
+        return self._end_run()
+
+    async def _run_in_task(self):
+        # Route input and output from this task to this test
+        _install_io_hooks()
+        self._loop = asyncio.get_running_loop()
+        self._start_inputs()
+        token = _active_test.set(self)
+        _add_running_test(self)
+
+        self._start_measuring()
+        try:
+            self._rval = await self.func(*self.args, **self.kwds)
+        finally:
+            # Stop capturing, even if there's an error. CPU time can't be
+            # told apart from other tasks on the loop, so it isn't measured.
+            self._stop_measuring(measure_cpu=False)
+            self._stop_inputs()
+            _discard_running_test(self)
+            _active_test.reset(token)
+
+        return self.rval
+
+    def _next_async_input(self) -> str:
+        """Waits for the next value from an async user_input feed. Must be
+        called from a thread other than the one running the event loop."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            raise UnitTestError(
+                "An async user_input feed can't be read by input() on the event "
+                "loop. Call input() through asyncio.to_thread() instead."
+            )
+        try:
+            return str(asyncio.run_coroutine_threadsafe(
+                anext(self._async_inputs), self._loop).result())
+        except StopAsyncIteration:
+            raise UnexpectedInputError("Program is asking for too many inputs!") from None
+
+
+def compare_diff(str1: str, str2: str):
+    """Compare two strings line by line and show the expected string (str2)
+    with the differences highlighted. Returns an empty string if equal."""
+    if str1 == str2:
+        return ""
+    error_color = Tcolors.fg.red + Tcolors.underline
+    # Without colors the differences are marked with text instead
+    marked = not error_color
+    lines1 = str1.splitlines(keepends=True)
+    lines2 = str2.splitlines(keepends=True)
+    opcodes = diff_lines(lines1, lines2)
+
+    out = []
+    for num, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == "equal":
+            # Only show a few matching lines around each change
+            keep_before = DIFF_CONTEXT if num > 0 else 0
+            keep_after = DIFF_CONTEXT if num < len(opcodes) - 1 else 0
+            if j2 - j1 > keep_before + keep_after + 1:
+                out.extend(lines2[j1:j1 + keep_before])
+                out.append(f"{Tcolors.fg.dgray}...[{j2 - j1 - keep_before - keep_after}"
+                           f" matching lines]{Tcolors.default}\n")
+                out.extend(lines2[j2 - keep_after:j2])
+            else:
+                out.extend(lines2[j1:j2])
+            continue
+
+        # Show character detail where a received line replaced an expected one
+        pairs = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        for line1, line2 in zip(lines1[i1:i1 + pairs], lines2[j1:j1 + pairs]):
+            same = 0
+            limit = min(len(line1), len(line2))
+            while same < limit and line1[same] == line2[same]:
+                same += 1
+            out.append(line2[:same])
+            if same < len(line2):
+                out.append(f"{error_color}{_visible(line2[same:])}{Tcolors.default}")
+                if marked:
+                    if not line2.endswith("\n"):
+                        out.append("\n")
+                    out.append(" " * same + "^\n")
+            else:
+                out.append(f"{error_color}...[{len(line1) - same} more chars"
+                           f" received]{Tcolors.default}\n")
+        for line2 in lines2[j1 + pairs:j2]:
+            out.append(f"{error_color}{'[missing] ' if marked else ''}"
+                       f"{_visible(line2)}{Tcolors.default}")
+        for line1 in lines1[i1 + pairs:i2]:
+            out.append(f"{error_color}[unexpected] {Tcolors.nunderline}"
+                       f"{_visible(line1)}{Tcolors.default}")
+        if out and not out[-1].endswith("\n"):
+            out.append("\n")
+
+    return "".join(out)
@@ -1,158 +1,1175 @@
-"""Test bed tool for running tests via command line"""
-import importlib.util
-import os
-import argparse
-import json
-import test_tools
-
-
-def get_args():
-    """Retreives arguments from the command line/terminal"""
-    parser = argparse.ArgumentParser()
-    parser.add_argument("filename")
-    parser.add_argument("-v", "--version", action="version", version="1.0")
-    parser.add_argument(
-        "-t", "--testfile", required=True, action="store", metavar="<test filename>"
-    )
-    return parser.parse_args()
-
-
-def read_test_file(filename):
-    """Reads and sanitizes test JSON data. Returns None if file is not valid."""
-    test_json = {}
-    try:
-        with open(filename, "r", encoding="utf-8") as file:
-            test_json = json.load(file)
-    except FileNotFoundError:
-        print(f"Error: File {filename} does not exist")
-        return None
-    except json.JSONDecodeError as err:
-        print(f"JSON Syntax Error: {err.msg}")
-        return None
-
-    if "tests" not in test_json:
-        print('Error: JSON File must have a "tests" object.')
-        return None
-
-    if not isinstance(test_json["tests"],list) or len(test_json["tests"]) <= 0:
-        print('Error: No tests found')
-        return None
-
-    valid_data = True
-    for num,test_data in enumerate(test_json["tests"]):
-        if not isinstance(test_data,dict):
-            print(f'Error in test {num + 1} "{test_data["name"]}":'
-                  ' Test must be a JSON obj')
-            valid_data = False
-            continue
-        if "function" not in test_data:
-            print(f'Error in test {num + 1} "{test_data["name"]}":'
-                  ' Each test must have a "function" section.')
-            valid_data = False
-            continue
-        if "config" not in test_data:
-            print(f'Error in test {num + 1} "{test_data["name"]}":'
-                  ' Each test must have a "config" section.')
-            valid_data = False
-            continue
-
-        # Convert/remove rval as needed. This is because I cannot set the
-        # default value in a JSON file, so I defined a new undefined string
-        # along with a prefix 'r:' that allows setting the literal string
-        # 'undefined'
-        rval_hold = test_data["config"].pop("expect_rval","undefined")
-        if rval_hold != "undefined":
-            if isinstance(rval_hold,str) and rval_hold.startswith("r:"):
-                test_data["config"]["expect_rval"] = rval_hold[2:]
-            else:
-                test_data["config"]["expect_rval"] = rval_hold
-
-    if not valid_data:
-        return None
-
-    return test_json
-
-
-def read_program(filename):
-    """Imports program file into it's own namespace"""
-    if not os.path.exists(filename):
-        print(f"Error: File {filename} does not exist")
-        return None
-
-    mod_name = str(os.path.splitext(os.path.basename(filename))[0])
-
-    spec = importlib.util.spec_from_file_location(mod_name, filename)
-    program = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(program)
-
-    return program
-
-
-def main():
-    """Entry point of the program"""
-    args = get_args()
-
-    test_json = read_test_file(args.testfile) or None
-    if test_json is None:
-        return
-
-    program = read_program(args.filename) or None
-    if program is None:
-        return
-
-    os.chdir(os.path.dirname(args.filename))
-
-    passed = 0
-    failed_tests = []
-    total_tests = len(test_json['tests'])
-    terminal_width = 80
-    try:
-        terminal_width = int(os.get_terminal_size().columns)
-    except OSError:
-        pass
-    file_basename = os.path.basename(args.filename)
-    num_equals = int((terminal_width - len(file_basename))/2) - 1
-
-    print(test_tools.Tcolors.fg.yellow)
-    print(f"Running tests in {os.path.basename(args.testfile)} ...")
-
-    print(f"{'='*num_equals} {file_basename} {'='*num_equals}")
-    print(test_tools.Tcolors.default)
-
-    for num,test_settings in enumerate(test_json["tests"]):
-        try:
-            test = test_tools.UnitTestPack(
-                getattr(program, test_settings["function"]),
-                *(test_settings.get("args",[])),
-                **(test_settings.get("kwdargs",{})),
-            ).config(**test_settings["config"])
-            test()
-        except KeyError as err:
-            print(f"{err}")
-
-        #pylint: disable=broad-exception-caught
-        except Exception:
-            pass
-
-        if test.success:
-            passed += 1
-        else:
-            failed_tests.append(f"Test {num + 1}: {test.name}")
-
-    print(test_tools.Tcolors.fg.yellow)
-    print(f"{'='*(int(terminal_width/2)-5)} Finished {'='*(int(terminal_width/2)-5)}")
-
-    if passed == total_tests:
-        print(test_tools.Tcolors.fg.green,end='')
-    print(f"{passed}/{total_tests} Tests Passed")
-
-    if len(failed_tests) > 0:
-        print("Failed tests:")
-        print(test_tools.Tcolors.fg.red,end='')
-        for ftest in failed_tests:
-            print(f"\t{ftest}")
-    print(test_tools.Tcolors.default)
-
-
-if __name__ == "__main__":
-    main()
+"""Test bed tool for running tests via command line"""
+from array import array
+from collections import namedtuple, deque
+from concurrent.futures.process import BrokenProcessPool
+import concurrent.futures
+import contextlib
+import copy
+import csv
+import heapq
+import importlib.util
+import inspect
+import io
+import multiprocessing
+import multiprocessing.connection
+import os
+import argparse
+import json
+import math
+import re
+import sys
+import tempfile
+import textwrap
+import reports
+import result_cache
+import test_tools
+
+TestResult = namedtuple(
+    "TestResult",
+    ("num", "name", "success", "output", "metrics", "benchmark", "cached", "touched",
+     "rval", "diff", "error", "profile"),
+    defaults=(None, False, None, None, None, None, None)
+)
+
+# Options that change how each test is run. details keeps the return value,
+# diff and exception of each test as plain text for reports, and quiet turns
+# on quiet mode in worker processes. profile_slow samples the stack of every
+# test and saves it in profile_dir for those that run longer.
+RunOptions = namedtuple(
+    "RunOptions", ("benchmark", "warmup", "track_calls", "details", "quiet",
+                   "profile_slow", "profile_dir"),
+    defaults=(0, 1, False, False, False, None, None)
+)
+
+
+class ResultTable:
+    """Results of a run kept in columns, one entry per test in test order:
+    a status and the wall and CPU time of each test, NaN where unknown.
+    Names are only kept for failed tests, so a million results take about
+    17 MB. With keep_details, the error and diff of each failed test are
+    kept for the summary too."""
+    __slots__ = ("statuses", "wall_times", "cpu_times", "failed_names",
+                 "failure_details", "keep_details")
+    PASSED = 1
+    CACHED = 2
+
+    def __init__(self, keep_details: bool = False):
+        self.statuses = array("b")
+        self.wall_times = array("d")
+        self.cpu_times = array("d")
+        self.failed_names = {}
+        self.failure_details = {}
+        self.keep_details = keep_details
+
+    def add(self, result):
+        """Records a TestResult"""
+        self.statuses.append((self.PASSED if result.success else 0)
+                             | (self.CACHED if result.cached else 0))
+        metrics = result.metrics
+        self.wall_times.append(math.nan if metrics is None else metrics.wall_time)
+        self.cpu_times.append(math.nan if metrics is None or metrics.cpu_time is None
+                              else metrics.cpu_time)
+        if not result.success:
+            self.failed_names[result.num] = result.name
+            details = "\n".join(text for text in (result.error, result.diff) if text)
+            if self.keep_details and details.strip():
+                self.failure_details[result.num] = details.strip("\n")
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def count(self, flag: int) -> int:
+        """Number of tests with a status flag set"""
+        return sum(1 for status in self.statuses if status & flag)
+
+    @staticmethod
+    def total(column) -> float:
+        """Sum of the known values in a column"""
+        return math.fsum(value for value in column if not math.isnan(value))
+
+
+def get_args():
+    """Retreives arguments from the command line/terminal"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename")
+    parser.add_argument("-v", "--version", action="version", version="1.0")
+    parser.add_argument(
+        "-t", "--testfile", required=True, action="store", metavar="<test filename>"
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true",
+        help="only print the summary, nothing while tests run"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, metavar="N",
+        help="number of worker processes to run tests in (default 1)"
+    )
+    parser.add_argument(
+        "--fork-server", action="store_true",
+        help="import the program once and run each test in a process forked "
+             "from it, -j at a time"
+    )
+    parser.add_argument(
+        "--slowest", type=int, default=5, metavar="N",
+        help="number of slowest tests to list in the summary (default 5)"
+    )
+    parser.add_argument(
+        "--benchmark", type=int, default=0, metavar="N",
+        help="time N extra runs of each test after checking its output"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=1, metavar="N",
+        help="untimed runs before the benchmark runs (default 1)"
+    )
+    parser.add_argument(
+        "--bench-out", metavar="<filename>",
+        help="write benchmark results to a .json or .csv file"
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="read and run tests one at a time instead of loading the whole "
+             "test file first (always on for .jsonl files)"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="run every test even if its result is cached"
+    )
+    parser.add_argument(
+        "--cache-file", default=".testbed_cache.json", metavar="<filename>",
+        help="file to cache test results in (default .testbed_cache.json)"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=10000, metavar="N",
+        help="number of results to keep in the cache (default 10000)"
+    )
+    parser.add_argument(
+        "--changed", action="store_true",
+        help="only run tests that call code which changed since their last run"
+    )
+    parser.add_argument(
+        "--deps-file", default=".testbed_deps.json", metavar="<filename>",
+        help="file to keep the code each test called in (default .testbed_deps.json)"
+    )
+    parser.add_argument(
+        "--report", action="append", default=[], metavar="<filename>",
+        help="write each result to a JUnit .xml or JSON Lines .jsonl report as "
+             "it finishes (can be given more than once)"
+    )
+    parser.add_argument(
+        "--profile-slow", type=float, metavar="SECONDS",
+        help="sample the stack of each test and save it as collapsed stacks "
+             "for tests that run longer than SECONDS or time out"
+    )
+    parser.add_argument(
+        "--profile-dir", default="profiles", metavar="<directory>",
+        help="directory to save test profiles in (default profiles)"
+    )
+    parser.add_argument(
+        "--shard", type=parse_shard, metavar="I/N",
+        help="only run shard I of N, split using the times in --durations"
+    )
+    parser.add_argument(
+        "--durations", metavar="<filename>",
+        help="JSON file of test times used to balance --shard. Runs without "
+             "--shard record their test times in it."
+    )
+    return parser.parse_args()
+
+
+def get_merge_args(argv):
+    """Retreives the arguments of the merge command"""
+    parser = argparse.ArgumentParser(
+        prog="testbed.py merge",
+        description="Combines the JSON Lines reports of several shards into one summary"
+    )
+    parser.add_argument("results", nargs="+", metavar="<report.jsonl>")
+    parser.add_argument(
+        "--slowest", type=int, default=5, metavar="N",
+        help="number of slowest tests to list in the summary (default 5)"
+    )
+    parser.add_argument(
+        "--report", action="append", default=[], metavar="<filename>",
+        help="write the combined results to a JUnit .xml or JSON Lines .jsonl "
+             "report (can be given more than once)"
+    )
+    parser.add_argument(
+        "--durations", metavar="<filename>",
+        help="record the test times in a JSON file for balancing later shards"
+    )
+    return parser.parse_args(argv)
+
+
+def parse_shard(text):
+    """Parses "I/N" into a zero based shard number and a shard count"""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text)
+    if match is None:
+        raise argparse.ArgumentTypeError(f'"{text}" is not a shard like 1/4')
+    shard, shards = int(match[1]), int(match[2])
+    if not 1 <= shard <= shards:
+        raise argparse.ArgumentTypeError(f"shard {shard} is not between 1 and {shards}")
+    return shard - 1, shards
+
+
+def validate_test(num, test_data):
+    """Checks a single test's JSON data and converts its expect_rval.
+    Prints the problem and returns False if the test is not valid."""
+    name = ""
+    if isinstance(test_data, dict) and isinstance(test_data.get("config"), dict):
+        name = test_data["config"].get("name") or ""
+    if not isinstance(test_data,dict):
+        print(f'Error in test {num + 1} "{name}":'
+              ' Test must be a JSON obj')
+        return False
+    if "function" not in test_data:
+        print(f'Error in test {num + 1} "{name}":'
+              ' Each test must have a "function" section.')
+        return False
+    if "config" not in test_data:
+        print(f'Error in test {num + 1} "{name}":'
+              ' Each test must have a "config" section.')
+        return False
+
+    if "rows" in test_data and not validate_table(num, name, test_data):
+        return False
+
+    # Convert/remove rval as needed. This is because I cannot set the
+    # default value in a JSON file, so I defined a new undefined string
+    # along with a prefix 'r:' that allows setting the literal string
+    # 'undefined'
+    rval_hold = test_data["config"].pop("expect_rval","undefined")
+    if rval_hold != "undefined":
+        test_data["config"]["expect_rval"] = convert_rval(rval_hold)
+    return True
+
+
+def test_name(test_settings) -> str:
+    """Name a test from the test file is listed under"""
+    if test_settings is None:
+        return "Invalid test"
+    if "row" in test_settings:
+        return test_settings["row"]["name"]
+    return test_settings["config"].get("name") or "Untitled"
+
+
+def convert_rval(rval):
+    """Strips the 'r:' prefix used to expect a literal "undefined" """
+    if isinstance(rval,str) and rval.startswith("r:"):
+        return rval[2:]
+    return rval
+
+
+# Columns a table test can have besides the UnitTestPack.config() options
+TABLE_COLUMNS = ("args", "kwdargs", "name")
+
+def validate_table(num, name, test_data):
+    """Checks the "columns" and "rows" of a table test.
+    Prints the problem and returns False if they are not valid."""
+    columns = test_data.get("columns")
+    config_keys = inspect.signature(test_tools.UnitTestPack.config).parameters
+    if (not isinstance(columns, list) or not columns
+            or len(set(map(str, columns))) != len(columns)):
+        print(f'Error in test {num + 1} "{name}":'
+              ' A table test must have a list of unique "columns".')
+        return False
+    for column in columns:
+        if not isinstance(column, str) or column not in TABLE_COLUMNS and (
+                column not in config_keys or column == "self"):
+            print(f'Error in test {num + 1} "{name}":'
+                  f' Unknown column "{column}".')
+            return False
+    rows = test_data["rows"]
+    if not isinstance(rows, list) or any(
+        not isinstance(row, list) or len(row) != len(columns) for row in rows
+    ):
+        print(f'Error in test {num + 1} "{name}":'
+              f' "rows" must be a list of rows with {len(columns)} values each.')
+        return False
+    return True
+
+
+def expand_tests(tests):
+    """Renumbers (number, test data) pairs, expanding each table test into
+    one test per row as it is reached. Rows share their table's function
+    and config, and only carry their own values."""
+    num = 0
+    for table, test_data in tests:
+        if test_data is None or "rows" not in test_data:
+            yield num, test_data
+            num += 1
+            continue
+        columns = test_data["columns"]
+        template_name = test_data["config"].get("name") or "Untitled"
+        for row_num, values in enumerate(test_data["rows"]):
+            row = dict(zip(columns, values))
+            settings = {
+                "function": test_data["function"],
+                "config": test_data["config"],
+                "table": table,
+                "args": row.pop("args", test_data.get("args", [])),
+                "kwdargs": row.pop("kwdargs", test_data.get("kwdargs", {})),
+                "row": row,
+            }
+            row["name"] = row.get("name") or f"{template_name} [{row_num + 1}]"
+            yield num, settings
+            num += 1
+
+
+def read_test_file(filename):
+    """Reads and sanitizes test JSON data. Returns None if file is not valid."""
+    test_json = {}
+    try:
+        with open(filename, "r", encoding="utf-8") as file:
+            test_json = json.load(file)
+    except FileNotFoundError:
+        print(f"Error: File {filename} does not exist")
+        return None
+    except json.JSONDecodeError as err:
+        print(f"JSON Syntax Error: {err.msg}")
+        return None
+
+    if "tests" not in test_json:
+        print('Error: JSON File must have a "tests" object.')
+        return None
+
+    if not isinstance(test_json["tests"],list) or len(test_json["tests"]) <= 0:
+        print('Error: No tests found')
+        return None
+
+    valid_data = True
+    for num,test_data in enumerate(test_json["tests"]):
+        if not validate_test(num, test_data):
+            valid_data = False
+
+    if not valid_data:
+        return None
+
+    return test_json
+
+
+class JSONStream:
+    """Reads JSON values one at a time from a text file, keeping only the
+    value being parsed in memory."""
+    WHITESPACE = re.compile(r"\s*")
+    # What could still follow a number that reached the end of the buffer
+    NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+    def __init__(self, file, chunk_size: int = 1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Reads more of the file. Reads get bigger while a single value
+        keeps growing so large values aren't re-parsed too often."""
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Returns the next character that isn't whitespace, or "" at the end"""
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._fill():
+                break
+        return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, *chars: str) -> str:
+        """Consumes the next character, which must be one of chars"""
+        char = self.peek()
+        if char == "" or char not in chars:
+            raise json.JSONDecodeError(
+                f"Expecting {' or '.join(repr(c) for c in chars)}", self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Parses and returns the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Probably cut off at the end of the buffer
+                if not self._fill():
+                    raise
+                continue
+            # A number cut off by the end of the buffer decodes as a shorter
+            # one, such as "-1." of "-1.5e3", so it's only complete once
+            # something else follows it
+            if (isinstance(value, (int, float)) and not self.eof
+                    and self.NUMBER_TAIL.fullmatch(self.buffer, end) and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_test_file(filename):
+    """Reads tests from a JSON test file one at a time and yields
+    (number, test data) pairs as they are read. Files ending in .jsonl hold
+    one test per line. Test data is None for tests that are not valid."""
+    try:
+        file = open(filename, "r", encoding="utf-8")  # pylint: disable = consider-using-with
+    except FileNotFoundError:
+        print(f"Error: File {filename} does not exist")
+        return
+
+    with file:
+        try:
+            if filename.lower().endswith(".jsonl"):
+                tests = (json.loads(line) for line in file if line.strip())
+            else:
+                tests = _iter_tests_array(JSONStream(file))
+            yield from expand_tests(
+                (num, test_data if validate_test(num, test_data) else None)
+                for num, test_data in enumerate(tests)
+            )
+        except json.JSONDecodeError as err:
+            print(f"JSON Syntax Error: {err.msg}")
+
+
+def _iter_tests_array(stream: JSONStream):
+    """Yields each item of the "tests" array of a JSON test file"""
+    stream.expect("{")
+    found = False
+    if stream.peek() == "}":
+        stream.pos += 1
+    else:
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == "tests" and stream.peek() == "[":
+                found = True
+                stream.expect("[")
+                if stream.peek() == "]":
+                    stream.pos += 1
+                else:
+                    while True:
+                        yield stream.value()
+                        if stream.expect(",", "]") == "]":
+                            break
+            else:
+                stream.value()
+            if stream.expect(",", "}") == "}":
+                break
+    if not found:
+        print('Error: JSON File must have a "tests" array.')
+
+
+def read_program(filename):
+    """Imports program file into it's own namespace"""
+    if not os.path.exists(filename):
+        print(f"Error: File {filename} does not exist")
+        return None
+
+    mod_name = str(os.path.splitext(os.path.basename(filename))[0])
+
+    spec = importlib.util.spec_from_file_location(mod_name, filename)
+    program = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(program)
+
+    return program
+
+
+# (program, table number, configured UnitTestPack) of the last table test
+# built, copied for each of its rows
+_table_test = (None, None, None)
+
+def build_test(program, test_settings):
+    """Makes a UnitTestPack for a test's JSON settings. The rows of a table
+    test each get a copy of a UnitTestPack that is only configured from the
+    table's config once, with the row's values applied on top. Rows never
+    share a UnitTestPack, so a row abandoned after a timeout can't touch the
+    rows after it."""
+    if "row" not in test_settings:
+        return test_tools.UnitTestPack(
+            getattr(program, test_settings["function"]),
+            *(test_settings.get("args",[])),
+            **(test_settings.get("kwdargs",{})),
+        ).config(**test_settings["config"])
+
+    global _table_test  # pylint: disable = global-statement
+    table_program, table, template = _table_test
+    if table_program is not program or table != test_settings["table"]:
+        template = test_tools.UnitTestPack(getattr(program, test_settings["function"]))
+        template.config(**test_settings["config"])
+        _table_test = (program, test_settings["table"], template)
+
+    # Only the settings the template changed are copied, results start out
+    # as the class defaults
+    test = copy.copy(template)
+    test.set_args(*test_settings["args"], **test_settings["kwdargs"])
+    for column, value in test_settings["row"].items():
+        if value is None or (column == "expect_rval" and value == "undefined"):
+            # Left as the table's config has it
+            continue
+        if column == "expect_rval":
+            test.expect_rval = convert_rval(value)
+        else:
+            test.config(**{column: value})
+    return test
+
+
+def run_test(program, num, test_settings, executor=None, options=RunOptions()):
+    """Builds and runs a single test from its JSON settings.
+    Returns a TestResult."""
+    if test_settings is None:
+        return TestResult(num, "Invalid test", False, None, None)
+    test = None
+    benchmark = None
+    build_error = None
+    try:
+        test = build_test(program, test_settings)
+        test.executor = executor
+        test.track_calls = options.track_calls
+        if options.profile_slow is not None:
+            test.profile_slow = options.profile_slow
+        if options.profile_dir is not None and "profile_dir" not in vars(test):
+            test.profile_dir = options.profile_dir
+        # Numbered so tests with the same name don't share a file
+        test.profile_name = f"{num + 1} {test.name}"
+        if options.benchmark > 0:
+            benchmark = test.benchmark(options.benchmark, options.warmup)
+        else:
+            test()
+    except KeyError as err:
+        print(f"{err}")
+        build_error = err
+
+    #pylint: disable=broad-exception-caught
+    except Exception as err:
+        build_error = err
+
+    if test is None:
+        return TestResult(num, test_name(test_settings), False, None, None,
+                          error=None if build_error is None else reports.plain_text(
+                              f"{type(build_error).__name__}: {build_error}"))
+    result = TestResult(num, test.name, test.success, None, test.metrics, benchmark,
+                        touched=test.touched_code if options.track_calls else None,
+                        profile=test.profile_file)
+    if options.details:
+        exception = test.exception
+        returned = not isinstance(test.rval, test_tools.UnknownValue)
+        result = result._replace(
+            rval=reports.plain_text(repr(test.rval)) if returned else None,
+            diff=reports.plain_text(test.diff_str or None),
+            error=None if exception is None else
+            reports.plain_text(f"{type(exception).__name__}: {exception}")
+        )
+    return result
+
+
+def format_metrics(metrics):
+    """Formats TestMetrics as a short line of text"""
+    parts = [f"{metrics.wall_time * 1000:.1f} ms"]
+    if metrics.cpu_time is not None:
+        parts.append(f"{metrics.cpu_time * 1000:.1f} ms CPU")
+    if metrics.peak_memory is not None:
+        parts.append(f"{metrics.peak_memory / 1024:.1f} KiB peak")
+    parts.append(f"{metrics.stdout_bytes} B out")
+    parts.append(f"{metrics.stderr_bytes} B err")
+    return ", ".join(parts)
+
+
+# Program imported by each worker process in parallel mode
+_worker_program = None
+_worker_options = RunOptions()
+
+def _init_worker(filename, workdir, options):
+    """Imports the program once per worker process"""
+    global _worker_program, _worker_options  # pylint: disable = global-statement
+    _worker_program = read_program(filename)
+    _worker_options = options
+    if options.quiet and test_tools.quiet_reporter() is None:
+        test_tools.set_quiet(max_failures=0)
+    os.chdir(workdir)
+
+
+class _OutputCollector(io.TextIOBase):
+    """Text stream that appends everything written to it to a shared list.
+    stdout and stderr each get their own collector so UnitTestPack can patch
+    them separately while the printed order is preserved."""
+    def __init__(self, chunks: list):
+        super().__init__()
+        self.chunks = chunks
+
+    def write(self, s):
+        self.chunks.append(s)
+        return len(s)
+
+
+def _run_captured(program, job, options):
+    """Runs a test, collecting everything it prints in the result's output so
+    the main process can show it in order."""
+    num, test_settings = job
+    chunks = []
+    with contextlib.redirect_stdout(_OutputCollector(chunks)), \
+         contextlib.redirect_stderr(_OutputCollector(chunks)):
+        result = run_test(program, num, test_settings,
+                          test_tools.default_executor(), options)
+    return result._replace(output="".join(chunks))
+
+
+def _run_in_worker(job):
+    """Runs a test in a worker process"""
+    return _run_captured(_worker_program, job, _worker_options)
+
+
+def _crashed_result(num, test_settings):
+    """Failed TestResult for a test whose worker process died"""
+    name = test_name(test_settings)
+    return TestResult(
+        num, name, False,
+        f"{test_tools.Tcolors.fg.red}Test {num + 1} \"{name}\" crashed its worker "
+        f"process{test_tools.Tcolors.default}\n",
+        None, error="Test crashed its worker process"
+    )
+
+
+def run_parallel(filename, tests, jobs, options=RunOptions()):
+    """Runs tests in a pool of worker processes and yields their results in
+    test order. Only a few tests per worker are queued ahead at a time.
+    Finished TestResults in tests are passed through in order.
+    A test that kills its worker, such as with os._exit or a crash in C
+    code, breaks the whole pool. Its result is then checked by running it
+    again on its own, and the tests that were queued with it are run again
+    in a new pool."""
+    def new_pool(workers):
+        return concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(filename, os.getcwd(), options))
+
+    pool = new_pool(jobs)
+    pending = deque()
+
+    def next_result():
+        nonlocal pool
+        entry = pending.popleft()
+        if isinstance(entry, TestResult):
+            return entry
+        job, future = entry
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            pass
+        except KeyboardInterrupt:
+            raise
+        except BaseException:  # pylint: disable = broad-exception-caught
+            # Such as SystemExit from a test run without a timeout
+            return _crashed_result(*job)
+
+        pool.shutdown(wait=True)
+        with new_pool(1) as solo:
+            try:
+                result = solo.submit(_run_in_worker, job).result()
+            except KeyboardInterrupt:
+                raise
+            except BaseException:  # pylint: disable = broad-exception-caught
+                result = _crashed_result(*job)
+        pool = new_pool(jobs)
+        for i, queued in enumerate(pending):
+            if (not isinstance(queued, TestResult)
+                    and isinstance(queued[1].exception(), BrokenProcessPool)):
+                pending[i] = (queued[0], pool.submit(_run_in_worker, queued[0]))
+        return result
+
+    try:
+        for job in tests:
+            if isinstance(job, TestResult):
+                pending.append(job)
+            else:
+                pending.append((job, pool.submit(_run_in_worker, job)))
+            if len(pending) >= jobs * 4:
+                yield next_result()
+        while pending:
+            yield next_result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _run_forked(conn, program, job, options):
+    """Runs a single test in a child of the fork server and sends back the
+    result"""
+    try:
+        conn.send(_run_captured(program, job, options))
+    finally:
+        conn.close()
+
+
+def _fork_server(conn, program, options):
+    """Template process for fork server mode. It starts out with the program
+    already imported and forks a child for each test it receives, so every
+    test gets its own copy of the freshly imported module. Results are sent
+    back as the children finish. A None job shuts the server down once the
+    running tests are done."""
+    context = multiprocessing.get_context("fork")
+    children = {}
+    accepting = True
+    while accepting or children:
+        waiting = list(children) + ([conn] if accepting else [])
+        for ready in multiprocessing.connection.wait(waiting):
+            if ready is conn:
+                job = conn.recv()
+                if job is None:
+                    accepting = False
+                    continue
+                receiver, sender = context.Pipe(duplex=False)
+                child = context.Process(target=_run_forked,
+                                        args=(sender, program, job, options))
+                child.start()
+                sender.close()
+                children[receiver] = (job[0], test_name(job[1]), child)
+                continue
+            num, name, child = children.pop(ready)
+            try:
+                result = ready.recv()
+            except EOFError:
+                result = None
+            ready.close()
+            child.join()
+            if result is None:
+                result = TestResult(
+                    num, name, False,
+                    f"{test_tools.Tcolors.fg.red}Test {num + 1} \"{name}\" crashed "
+                    f"(exit code {child.exitcode}){test_tools.Tcolors.default}\n",
+                    None
+                )
+            conn.send(result)
+    conn.close()
+
+
+def run_forked(program, tests, jobs, options=RunOptions()):
+    """Runs each test in a process forked from a copy of this one, taken
+    after the program was imported, so tests don't pay for importing it
+    again and never see another test's changes to its module state. Up to
+    jobs tests run at once and their results are yielded in test order.
+    Finished TestResults in tests are passed through in order."""
+    context = multiprocessing.get_context("fork")
+    conn, server_conn = context.Pipe()
+    server = context.Process(target=_fork_server,
+                             args=(server_conn, program, options))
+    server.start()
+    server_conn.close()
+    pending = deque()
+    finished = {}
+    running = 0
+
+    def receive():
+        try:
+            result = conn.recv()
+        except EOFError:
+            server.join()
+            raise test_tools.UnitTestError(
+                f"Fork server stopped unexpectedly (exit code {server.exitcode})"
+            ) from None
+        finished[result.num] = result
+
+    try:
+        for job in tests:
+            if isinstance(job, TestResult):
+                pending.append(job)
+            else:
+                while running >= jobs:
+                    receive()
+                    running -= 1
+                conn.send(job)
+                pending.append(job[0])
+                running += 1
+            while pending and (isinstance(pending[0], TestResult) or pending[0] in finished):
+                item = pending.popleft()
+                yield item if isinstance(item, TestResult) else finished.pop(item)
+        while pending:
+            item = pending.popleft()
+            if isinstance(item, TestResult):
+                yield item
+                continue
+            while item not in finished:
+                receive()
+            yield finished.pop(item)
+    finally:
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+        server.join()
+        conn.close()
+
+
+def duration_key(num, name) -> str:
+    """Key of a test in a durations file. Tests are matched by both number
+    and name, so an edited test file only loses the times of moved tests."""
+    return f"{num + 1}: {name}"
+
+
+def load_durations(filename) -> dict:
+    """Reads recorded test times. A missing or damaged file is empty."""
+    try:
+        with open(filename, "r", encoding="utf-8") as file:
+            durations = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(durations, dict):
+        return {}
+    return {key: value for key, value in durations.items()
+            if isinstance(value, (int, float)) and value >= 0}
+
+
+def save_durations(filename, durations: dict):
+    """Writes recorded test times, replacing the file in one step"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w", encoding="utf-8") as file:
+            json.dump(durations, file, indent=0)
+        os.replace(temp_name, filename)
+    except OSError:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
+def assign_shards(tests, shards: int, durations: dict):
+    """Splits tests between shards, giving the longest test that is left to
+    the shard with the least work so far. Tests without a recorded time count
+    as the average one. Returns the shard of each test, indexed by test
+    number. Every shard of a run gets the same split from the same test file
+    and durations."""
+    times = array("d")
+    for num, test_settings in tests:
+        seconds = durations.get(duration_key(num, test_name(test_settings)))
+        times.append(math.nan if seconds is None else seconds)
+    known = [seconds for seconds in times if not math.isnan(seconds)]
+    default = math.fsum(known) / len(known) if known else 1.0
+    for num, seconds in enumerate(times):
+        if math.isnan(seconds):
+            times[num] = default
+
+    # Ties go to the lower test number and shard, so the split is repeatable
+    loads = [(0.0, shard) for shard in range(shards)]
+    shard_of = array("I", [0]) * len(times)
+    for num in sorted(range(len(times)), key=lambda num: -times[num]):
+        load, shard = loads[0]
+        shard_of[num] = shard
+        heapq.heapreplace(loads, (load + times[num], shard))
+    return shard_of
+
+
+def read_results(filenames):
+    """Reads TestResults back from JSON Lines reports, sorted by test number.
+    Where a test appears more than once, its last result is kept."""
+    results = {}
+    suite = ""
+    for filename in filenames:
+        with open(filename, "r", encoding="utf-8") as file:
+            for line_num, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    num = int(record["num"]) - 1
+                    name = str(record["name"])
+                except (ValueError, KeyError, TypeError):
+                    # Such as the last line of a shard that was killed
+                    print(f"{test_tools.Tcolors.fg.red}Skipping line {line_num} of "
+                          f"{filename}: not a test result{test_tools.Tcolors.default}")
+                    continue
+                suite = suite or record.get("suite") or ""
+                metrics = None
+                if record.get("wall_time") is not None:
+                    metrics = test_tools.TestMetrics(
+                        record["wall_time"], record.get("cpu_time"),
+                        record.get("peak_memory"), record.get("stdout_bytes", 0),
+                        record.get("stderr_bytes", 0)
+                    )
+                results[num] = TestResult(
+                    num, name, record.get("status") == "passed", None, metrics,
+                    cached=bool(record.get("cached")), rval=record.get("rval"),
+                    diff=record.get("diff"), error=record.get("error"),
+                    profile=record.get("profile")
+                )
+    return suite, [results[num] for num in sorted(results)]
+
+
+def skip_cached(tests, cache, keys):
+    """Yields a cached TestResult for each test whose result the cache says
+    can be reused, and the (number, settings) pair of every other test. The
+    cache key of each test that still has to run is stored in keys by test
+    number."""
+    for num, test_settings in tests:
+        if test_settings is None:
+            yield num, test_settings
+            continue
+        key, entry = cache.lookup(test_settings)
+        if entry is None:
+            keys[num] = key
+            yield num, test_settings
+        else:
+            yield TestResult(num, entry["name"], entry["success"], None, None, cached=True)
+
+
+def write_benchmarks(filename, benchmarks):
+    """Writes benchmark results to a JSON or CSV file, picked by extension"""
+    fields = test_tools.BenchmarkResult._fields
+    with open(filename, "w", encoding="utf-8", newline="") as file:
+        if filename.lower().endswith(".csv"):
+            writer = csv.writer(file)
+            writer.writerow(("test",) + fields)
+            for num, benchmark in benchmarks:
+                writer.writerow((num + 1,) + tuple(benchmark))
+        else:
+            json.dump(
+                [{"test": num + 1, **benchmark._asdict()} for num, benchmark in benchmarks],
+                file, indent=4
+            )
+
+
+def get_terminal_width() -> int:
+    """Width of the terminal, or 80 if there isn't one"""
+    try:
+        return int(os.get_terminal_size().columns)
+    except OSError:
+        return 80
+
+
+def keep_slowest(slowest: list, limit: int, result):
+    """Adds a TestResult to a heap of the limit slowest tests"""
+    if result.metrics is None or limit <= 0:
+        return
+    entry = (result.metrics.wall_time, result.num, result.name, result.metrics)
+    if len(slowest) < limit:
+        heapq.heappush(slowest, entry)
+    else:
+        heapq.heappushpop(slowest, entry)
+
+
+def print_summary(table: ResultTable, slowest, terminal_width: int = 80):
+    """Prints the totals of a run, its failed tests and the slowest tests
+    from a heap of (wall time, number, name, metrics)"""
+    print(test_tools.Tcolors.fg.yellow)
+    print(f"{'='*(int(terminal_width/2)-5)} Finished {'='*(int(terminal_width/2)-5)}")
+
+    passed = table.count(ResultTable.PASSED)
+    cached_tests = table.count(ResultTable.CACHED)
+    if passed == len(table):
+        print(test_tools.Tcolors.fg.green,end='')
+    print(f"{passed}/{len(table)} Tests Passed", end='')
+    print(f" ({cached_tests} cached)" if cached_tests > 0 else "")
+
+    if len(table.failed_names) > 0:
+        print("Failed tests:")
+        print(test_tools.Tcolors.fg.red,end='')
+        for num, name in table.failed_names.items():
+            print(f"\tTest {num + 1}: {name}")
+            if num in table.failure_details:
+                print(test_tools.Tcolors.default, end='')
+                print(textwrap.indent(table.failure_details[num], "\t\t"))
+                print(test_tools.Tcolors.fg.red, end='')
+
+    print(test_tools.Tcolors.default, end='')
+    print(f"Test time: {ResultTable.total(table.wall_times):.3f} s, "
+          f"CPU time: {ResultTable.total(table.cpu_times):.3f} s")
+
+    if len(slowest) > 0:
+        print(test_tools.Tcolors.fg.yellow, end='')
+        print("Slowest tests:")
+        print(test_tools.Tcolors.default, end='')
+        for _, num, name, metrics in sorted(slowest, reverse=True):
+            print(f"\tTest {num + 1}: {name} ({format_metrics(metrics)})")
+
+
+def merge(args):
+    """Combines the JSON Lines reports of a sharded run into one summary"""
+    try:
+        suite, results = read_results(args.results)
+        report_files = [reports.open_report(report, suite) for report in args.report]
+    except (OSError, ValueError) as err:
+        print(f"{test_tools.Tcolors.fg.red}{err}{test_tools.Tcolors.default}")
+        return
+    durations = load_durations(args.durations) if args.durations else None
+    table = ResultTable(keep_details=True)
+    slowest = []
+    try:
+        for result in results:
+            table.add(result)
+            for report in report_files:
+                report.add(result)
+            if durations is not None and result.metrics is not None:
+                durations[duration_key(result.num, result.name)] = round(
+                    result.metrics.wall_time, 6)
+            keep_slowest(slowest, args.slowest, result)
+    finally:
+        for report in report_files:
+            report.close()
+    if durations is not None:
+        save_durations(args.durations, durations)
+
+    print_summary(table, slowest, get_terminal_width())
+    print(test_tools.Tcolors.default)
+
+
+def main():
+    """Entry point of the program"""
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        merge(get_merge_args(sys.argv[2:]))
+        return
+    args = get_args()
+
+    # Streamed tests are read after changing to the program's folder
+    test_file = os.path.abspath(args.testfile)
+    if args.stream or test_file.lower().endswith(".jsonl"):
+        # Validated as they are read
+        def read_tests():
+            return iter_test_file(test_file)
+    else:
+        test_json = read_test_file(test_file) or None
+        if test_json is None:
+            return
+        def read_tests():
+            return expand_tests(enumerate(test_json["tests"]))
+    tests = read_tests()
+    durations = None
+    if args.durations:
+        durations_file = os.path.abspath(args.durations)
+        durations = load_durations(durations_file)
+    if args.shard is not None:
+        shard, shards = args.shard
+        # Problems with the test file are printed when the shard's tests are read
+        with contextlib.redirect_stdout(io.StringIO()):
+            shard_of = assign_shards(tests, shards, durations or {})
+        tests = (job for job in read_tests() if shard_of[job[0]] == shard)
+        # Only a merge of every shard's times is recorded
+        durations = None
+
+    program = read_program(args.filename) or None
+    if program is None:
+        return
+    if args.fork_server and "fork" not in multiprocessing.get_all_start_methods():
+        print(f"{test_tools.Tcolors.fg.red}--fork-server needs a platform that "
+              f"supports fork{test_tools.Tcolors.default}")
+        return
+
+    filename = os.path.abspath(args.filename)
+    profile_dir = os.path.abspath(args.profile_dir)
+    bench_out = os.path.abspath(args.bench_out) if args.bench_out else None
+    try:
+        report_files = [reports.open_report(report, os.path.basename(filename))
+                        for report in args.report]
+    except (OSError, ValueError) as err:
+        print(f"{test_tools.Tcolors.fg.red}{err}{test_tools.Tcolors.default}")
+        return
+    cache = None
+    cache_keys = {}
+    if args.changed:
+        cache = result_cache.DependencyCache(
+            os.path.abspath(args.deps_file), args.cache_size, filename).load()
+    elif not args.no_cache and args.benchmark <= 0 and (args.profile_slow or 0) <= 0:
+        cache = result_cache.ResultCache(
+            os.path.abspath(args.cache_file), args.cache_size,
+            result_cache.hash_file(filename)).load()
+    if cache is not None:
+        tests = skip_cached(tests, cache, cache_keys)
+    os.chdir(os.path.dirname(filename))
+
+    # Quiet runs print nothing while tests run, so failures are shown in the
+    # summary instead
+    table = ResultTable(keep_details=args.quiet)
+    slowest = []
+    profiles = 0
+    terminal_width = get_terminal_width()
+    file_basename = os.path.basename(args.filename)
+    num_equals = int((terminal_width - len(file_basename))/2) - 1
+
+    if args.quiet:
+        # Results are kept in the table, so the reporter only counts them
+        test_tools.set_quiet(max_failures=0)
+    else:
+        print(test_tools.Tcolors.fg.yellow)
+        print(f"Running tests in {os.path.basename(args.testfile)}"
+              + (f" (shard {args.shard[0] + 1}/{args.shard[1]})" if args.shard else "")
+              + " ...")
+
+        print(f"{'='*num_equals} {file_basename} {'='*num_equals}")
+        print(test_tools.Tcolors.default)
+
+    options = RunOptions(args.benchmark, args.warmup, args.changed,
+                         bool(report_files) or args.quiet, args.quiet,
+                         args.profile_slow if (args.profile_slow or 0) > 0 else None,
+                         profile_dir)
+    benchmarks = []
+    executor = test_tools.TestExecutor()
+    if args.fork_server:
+        results = run_forked(program, tests, max(args.jobs, 1), options)
+    elif args.jobs > 1:
+        results = run_parallel(filename, tests, args.jobs, options)
+    else:
+        results = (
+            job if isinstance(job, TestResult)
+            else run_test(program, job[0], job[1], executor, options)
+            for job in tests
+        )
+
+    try:
+        with executor:
+            for result in results:
+                table.add(result)
+                if result.profile is not None:
+                    profiles += 1
+                if result.output and not args.quiet:
+                    print(result.output, end="")
+                if result.cached:
+                    if not args.quiet:
+                        print(f"{test_tools.Tcolors.fg.dgray}\tCached test: {result.name} "
+                              f"({'passed' if result.success else 'failed'})"
+                              f"{test_tools.Tcolors.default}")
+                elif cache is not None and result.num in cache_keys:
+                    cache.store(cache_keys.pop(result.num), result.name,
+                                result.success, result.touched)
+                for report in report_files:
+                    report.add(result)
+                if durations is not None and result.metrics is not None:
+                    durations[duration_key(result.num, result.name)] = round(
+                        result.metrics.wall_time, 6)
+                if result.benchmark is not None:
+                    benchmarks.append((result.num, result.benchmark))
+                keep_slowest(slowest, args.slowest, result)
+    finally:
+        # Keep the results of finished tests even if the run is interrupted
+        if cache is not None:
+            cache.save()
+        for report in report_files:
+            report.close()
+        if durations is not None:
+            save_durations(durations_file, durations)
+
+    if len(table) == 0:
+        print(f"{test_tools.Tcolors.fg.red}Error: No tests were read from "
+              f"{args.testfile}{test_tools.Tcolors.default}")
+        return
+
+    print_summary(table, slowest, terminal_width)
+    if profiles > 0:
+        print(f"{profiles} test profile(s) saved in {profile_dir}")
+
+    if len(benchmarks) > 0:
+        print(test_tools.Tcolors.fg.yellow, end='')
+        print(f"Benchmarks ({args.benchmark} runs, {args.warmup} warmup):")
+        print(test_tools.Tcolors.default, end='')
+        for num, bench in benchmarks:
+            if bench.runs == 0:
+                print(f"\tTest {num + 1}: {bench.name} (not timed)")
+                continue
+            print(f"\tTest {num + 1}: {bench.name} (min {bench.min * 1000:.3f} ms,"
+                  f" median {bench.median * 1000:.3f} ms, p95 {bench.p95 * 1000:.3f} ms,"
+                  f" stddev {bench.stddev * 1000:.3f} ms)")
+        if bench_out:
+            write_benchmarks(bench_out, benchmarks)
+    print(test_tools.Tcolors.default)
+
+
+if __name__ == "__main__":
+    main()